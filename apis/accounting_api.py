@@ -1,10 +1,19 @@
+from apis.archive import archive_lines, check_archive, read_archive, restore
 from apis.authentication_api import check_signed
-from datetime import datetime
-from flask import Blueprint, Flask, jsonify, render_template, redirect, request
-import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
-import sqlite3
+from apis.db import get_db, release_on_close
+from apis.importer import batches, file_kind, max_errors, read_errors, read_file, row_errors
+from apis.invalidation import publish
+from apis.money import to_display
+from apis.reports import forget_reports, report
+from apis.schema import all_fys, create_balances, create_fy_tables, create_user_tables, drop_fy, layout, migrate, rebuild_balances, scopes, SINGLE
+from apis.search_index import evict, forget_fys, forget_ledgers, search
+from apis.streaming import csv_bytes, gzip_lines, zip_stream
+from apis.validation import check_entries, check_ids, entry_fields
+from datetime import datetime, timedelta
+from flask import Blueprint, Flask, jsonify, render_template, redirect, request, Response, stream_with_context
+from importlib.util import find_spec
+from urllib.parse import quote
+import itertools, json, sqlite3, tempfile
 
 accounting = Blueprint("accounting", __name__)
 
@@ -23,6 +32,258 @@ def check_fields(form, required_fields):
 			}
 	return False
 
+def bs_total(accounts):
+	return sum([i["amount"] for i in accounts if i["operation"] == "add"]) - sum([i["amount"] for i in accounts if i["operation"] == "less"])
+
+def check_dates(args, fields):
+	for field in fields:
+		if args.get(field):
+			try:
+				datetime.strptime(args.get(field), "%Y-%m-%d")
+			except:
+				return {
+					"error": "invalid date",
+					"field": field
+				}
+	return False
+
+def next_day(date):
+	return (datetime.strptime(date, "%Y-%m-%d") + timedelta(days=1)).strftime("%Y-%m-%d")
+
+def check_journal_args(args):
+	error = check_dates(args, ["from", "to"])
+	if error:
+		return error
+	for field, maximum in [("after", None), ("limit", 1000)]:
+		if args.get(field):
+			try:
+				value = int(args.get(field))
+			except:
+				return {
+					"error": f"invalid {field}",
+					"field": field
+				}
+			if value < 1 or (maximum and value > maximum):
+				return {
+					"error": f"invalid {field}",
+					"field": field
+				}
+	return False
+
+def journal_where(journal_scope, args):
+	where, params = [journal_scope.where], list(journal_scope.params)
+	if args.get("from"):
+		where.append("date>=?")
+		params.append(args.get("from"))
+	if args.get("to"):
+		where.append("date<=?")
+		params.append(args.get("to"))
+	if args.get("account"):
+		where.append("(ac_debited=? OR ac_credited=?)")
+		params += [args.get("account"), args.get("account")]
+	if args.get("after"):
+		where.append("id>?")
+		params.append(int(args.get("after")))
+	return " AND ".join(where), tuple(params)
+
+def journal_lines(db, cursor, fy_name, total, limit=None):
+	page_total, count, last = 0, 0, None
+	while count != limit:
+		entries = cursor.fetchmany(min(500, limit - count) if limit else 500)
+		if not entries:
+			break
+		lines = []
+		for entry in entries:
+			entry = dict(entry)
+			page_total += entry["amount"]
+			last = entry["id"]
+			entry["amount"] = to_display(entry["amount"])
+			lines.append(json.dumps(entry))
+		count += len(entries)
+		yield "\n".join(lines) + "\n"
+	next_id = last if limit and count == limit and cursor.fetchone() else None
+	db.close()
+	yield json.dumps({
+		"total": to_display(total),
+		"page_total": to_display(page_total),
+		"count": count,
+		"next": next_id,
+		"fy_name": fy_name
+	}) + "\n"
+
+def balances_before(tables, date, account=None):
+	journal_scope, periods_scope = tables["journal"], tables["periods"]
+	month = date[:7]
+	periods_where, debit_where, credit_where, account_params = "", "", "", ()
+	if account is not None:
+		periods_where, debit_where, credit_where, account_params = " AND account=?", " AND ac_debited=?", " AND ac_credited=?", (account,)
+	return f"""SELECT account, SUM(debit) AS debit, SUM(credit) AS credit FROM (
+		SELECT account, debit, credit FROM {periods_scope.table} WHERE {periods_scope.where} AND period<?{periods_where}
+		UNION ALL SELECT ac_debited, amount, 0 FROM {journal_scope.table} WHERE {journal_scope.where} AND date>=? AND date<?{debit_where}
+		UNION ALL SELECT ac_credited, 0, amount FROM {journal_scope.table} WHERE {journal_scope.where} AND date>=? AND date<?{credit_where}
+	) GROUP BY account""", (
+		periods_scope.params + (month,) + account_params
+		+ journal_scope.params + (f"{month}-01", date) + account_params
+		+ journal_scope.params + (f"{month}-01", date) + account_params
+	)
+
+def ledger_rows(debit_side, credit_side):
+	rows = [["Dr", "", "", "", "", "Cr"], ["Date", "Particulars", "Amount", "Date", "Particulars", "Amount"]]
+	for i in range(max(len(debit_side), len(credit_side))):
+		debit = debit_side[i] if i < len(debit_side) else None
+		credit = credit_side[i] if i < len(credit_side) else None
+		rows.append(
+			([debit[0], debit[1], to_display(debit[2])] if debit else ["", "", ""])
+			+ ([credit[0], credit[1], to_display(credit[2])] if credit else ["", "", ""])
+		)
+	debit_total = sum([i[2] for i in debit_side])
+	credit_total = sum([i[2] for i in credit_side])
+	balance = debit_total - credit_total
+	if balance:
+		start = 3 if balance > 0 else 0
+		balance_row = ["", "Balance c/d", to_display(abs(balance))]
+		for row in rows[2:]:
+			if not row[start+2]:
+				row[start:start+3] = balance_row
+				break
+		else:
+			rows.append(["", "", ""] + balance_row if balance > 0 else balance_row + ["", "", ""])
+	total = to_display(max(debit_total, credit_total))
+	rows.append(["", "", "", "", "", ""])
+	rows.append(["", "", total, "", "", total])
+	return rows
+
+def ledger_files(db, cursor, journal_scope, fy_name):
+	try:
+		cursor.execute(f"""SELECT account, side, date, other, amount FROM (
+				SELECT ac_debited AS account, 0 AS side, date, ac_credited AS other, amount, id FROM {journal_scope.table} WHERE {journal_scope.where}
+				UNION ALL SELECT ac_credited, 1, date, ac_debited, amount, id FROM {journal_scope.table} WHERE {journal_scope.where}
+			) ORDER BY account, side, date, id
+		""", journal_scope.params + journal_scope.params)
+		for account, rows in itertools.groupby(cursor, key=lambda i: i[0]):
+			sides = ([], [])
+			for _, side, date, other, amount in rows:
+				sides[side].append((date, other, amount))
+			yield f"{fy_name}_{account}_account.csv", csv_bytes(ledger_rows(*sides))
+	finally:
+		db.close()
+
+def check_layout(cursor, user_id):
+	version = request.headers.get("X-Layout")
+	if version is not None and version != str(layout(cursor, user_id)):
+		return {"error": "Your journals have been moved, reload the page"}
+	return False
+
+def check_balances(cursor, user_id, fy_id):
+	if layout(cursor, user_id) == SINGLE:
+		return
+	cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (f"periods_{user_id}_{fy_id}",))
+	if cursor.fetchone():
+		return
+	create_balances(cursor, user_id, fy_id)
+	rebuild_balances(cursor, scopes(cursor, user_id, fy_id))
+	cursor.connection.commit()
+
+def update_balances(cursor, tables, ids, sign):
+	journal_scope, balances_scope, periods_scope = tables["journal"], tables["balances"], tables["periods"]
+	cursor.executemany(f"""INSERT INTO {balances_scope.table} ({balances_scope.columns}account, debit, credit, entries)
+		SELECT {journal_scope.columns}ac_debited, {sign}amount, 0, {sign}1 FROM {journal_scope.table} WHERE {journal_scope.where} AND id=?
+		UNION ALL SELECT {journal_scope.columns}ac_credited, 0, {sign}amount, {sign}1 FROM {journal_scope.table} WHERE {journal_scope.where} AND id=?
+		ON CONFLICT({balances_scope.columns}account) DO UPDATE SET
+			debit=debit+excluded.debit,
+			credit=credit+excluded.credit,
+			entries=entries+excluded.entries
+	""", [journal_scope.params + (i,) + journal_scope.params + (i,) for i in ids])
+	cursor.executemany(f"""INSERT INTO {periods_scope.table} ({periods_scope.columns}period, account, debit, credit, entries)
+		SELECT {journal_scope.columns}substr(date, 1, 7), ac_debited, {sign}amount, 0, {sign}1 FROM {journal_scope.table} WHERE {journal_scope.where} AND id=?
+		UNION ALL SELECT {journal_scope.columns}substr(date, 1, 7), ac_credited, 0, {sign}amount, {sign}1 FROM {journal_scope.table} WHERE {journal_scope.where} AND id=?
+		ON CONFLICT({periods_scope.columns}period, account) DO UPDATE SET
+			debit=debit+excluded.debit,
+			credit=credit+excluded.credit,
+			entries=entries+excluded.entries
+	""", [journal_scope.params + (i,) + journal_scope.params + (i,) for i in ids])
+
+def add_balances(cursor, tables, first_id, last_id):
+	journal_scope, balances_scope, periods_scope = tables["journal"], tables["balances"], tables["periods"]
+	cursor.execute(f"""INSERT INTO {balances_scope.table} ({balances_scope.columns}account, debit, credit, entries)
+		SELECT {balances_scope.values}account, SUM(debit), SUM(credit), COUNT(*) FROM (
+			SELECT ac_debited AS account, amount AS debit, 0 AS credit FROM {journal_scope.table} WHERE {journal_scope.where} AND id BETWEEN ? AND ?
+			UNION ALL SELECT ac_credited, 0, amount FROM {journal_scope.table} WHERE {journal_scope.where} AND id BETWEEN ? AND ?
+		) GROUP BY account
+		ON CONFLICT({balances_scope.columns}account) DO UPDATE SET
+			debit=debit+excluded.debit,
+			credit=credit+excluded.credit,
+			entries=entries+excluded.entries
+	""", balances_scope.params + journal_scope.params + (first_id, last_id) + journal_scope.params + (first_id, last_id))
+	cursor.execute(f"""INSERT INTO {periods_scope.table} ({periods_scope.columns}period, account, debit, credit, entries)
+		SELECT {periods_scope.values}period, account, SUM(debit), SUM(credit), COUNT(*) FROM (
+			SELECT substr(date, 1, 7) AS period, ac_debited AS account, amount AS debit, 0 AS credit FROM {journal_scope.table} WHERE {journal_scope.where} AND id BETWEEN ? AND ?
+			UNION ALL SELECT substr(date, 1, 7), ac_credited, 0, amount FROM {journal_scope.table} WHERE {journal_scope.where} AND id BETWEEN ? AND ?
+		) GROUP BY period, account
+		ON CONFLICT({periods_scope.columns}period, account) DO UPDATE SET
+			debit=debit+excluded.debit,
+			credit=credit+excluded.credit,
+			entries=entries+excluded.entries
+	""", periods_scope.params + journal_scope.params + (first_id, last_id) + journal_scope.params + (first_id, last_id))
+
+def import_lines(db, cursor, tables, data, kind, key):
+	journal_scope = tables["journal"]
+	errors, checked, inserted = [], 0, 0
+	try:
+		missing, rows = read_file(data, kind)
+		if missing:
+			errors.append({"error": f"Missing columns: {', '.join(missing)}"})
+		else:
+			for numbers, entries in batches(rows):
+				batch_errors, _ = check_entries(entries)
+				errors += row_errors(batch_errors, numbers)[:max_errors - len(errors)]
+				checked += len(entries)
+				yield json.dumps({"checked": checked}) + "\n"
+				if len(errors) >= max_errors:
+					break
+		if errors:
+			yield json.dumps({"errors": errors, "checked": checked}) + "\n"
+			return
+		_, rows = read_file(data, kind)
+		for numbers, entries in batches(rows):
+			_, columns = check_entries(entries)
+			cursor.executemany(f"INSERT INTO {journal_scope.table} ({journal_scope.columns}date, ac_debited, ac_credited, amount, description) VALUES({journal_scope.values}?, ?, ?, ?, ?)",
+				[journal_scope.params + i for i in zip(*[columns[field] for field in entry_fields])])
+			cursor.execute(f"SELECT COALESCE(MAX(id), 0) FROM {journal_scope.table}")
+			last_id = cursor.fetchone()[0]
+			add_balances(cursor, tables, last_id - len(entries) + 1, last_id)
+			publish(cursor, "reports", *key)
+			db.commit()
+			forget_reports(*key)
+			forget_ledgers(*key)
+			inserted += len(entries)
+			yield json.dumps({"inserted": inserted, "checked": checked}) + "\n"
+		yield json.dumps({"success": 1, "inserted": inserted}) + "\n"
+	except read_errors as e:
+		print(e)
+		yield json.dumps({"errors": [{"error": "Unreadable file"}], "inserted": inserted}) + "\n"
+	finally:
+		db.close()
+		data.close()
+
+@accounting.cli.command("rebuild-balances")
+def rebuild_balances_command():
+	db = get_db()
+	cursor = db.cursor()
+	fys = all_fys(cursor)
+	for user_id, fy_id in fys:
+		if layout(cursor, user_id) != SINGLE:
+			create_balances(cursor, user_id, fy_id)
+		rebuild_balances(cursor, scopes(cursor, user_id, fy_id))
+	db.commit()
+	db.close()
+	print(f"Rebuilt balances for {len(fys)} journals")
+
+@accounting.cli.command("migrate-schema")
+def migrate_schema_command():
+	users = migrate(get_db())
+	print(f"Moved {users} users to the single-table schema")
+
 @accounting.route("/", methods=["GET"])
 def index():
 	if not check_signed(request.cookies):
@@ -41,17 +302,18 @@ def fy():
 	signed = check_signed(request.cookies)
 	if not signed:
 		return redirect("/auth")
-	db = sqlite3.connect("data.db")
+	db = get_db()
 	cursor = db.cursor()
 	cursor.row_factory = sqlite3.Row
-	cursor.execute("SELECT id FROM users WHERE token=?", (request.cookies.get("user_token"),))
-	user_id = dict(cursor.fetchone()).get("id")
-	cursor.execute(f"""CREATE TABLE IF NOT EXISTS fys_{user_id} (
-		id INTEGER PRIMARY KEY UNIQUE NOT NULL,
-		name TEXT NOT NULL,
-		status TEXT NOT NULL DEFAULT "open"
-	)""")
+	user_id = signed.get("id")
+	create_user_tables(cursor, user_id)
 	db.commit()
+	fys_scope = scopes(cursor, user_id)["fys"]
+	if request.method != "GET":
+		error = check_layout(cursor, user_id)
+		if error:
+			db.close()
+			return jsonify(error), 409
 	if request.method == "POST":
 		if signed.get("status") == "closed":
 			db.close()
@@ -65,7 +327,7 @@ def fy():
 			db.close()
 			return jsonify(error), 400
 		fy_name = request.form.get("fy_name").strip()
-		cursor.execute(f"SELECT * FROM fys_{user_id} WHERE name=?", (fy_name,))
+		cursor.execute(f"SELECT id, name, status FROM {fys_scope.table} WHERE {fys_scope.where} AND name=?", fys_scope.params + (fy_name,))
 		row = cursor.fetchone()
 		if row:
 			db.close()
@@ -73,44 +335,29 @@ def fy():
 				"error": "Journal already exists",
 				"id": row["id"]
 			}), 400
-		cursor.execute(f"INSERT INTO fys_{user_id} (name) VALUES(?)", (fy_name,))
-		cursor.execute(f"SELECT * FROM fys_{user_id} WHERE name=?", (fy_name,))
+		cursor.execute(f"INSERT INTO {fys_scope.table} ({fys_scope.columns}name) VALUES({fys_scope.values}?)", fys_scope.params + (fy_name,))
+		cursor.execute(f"SELECT id, name, status FROM {fys_scope.table} WHERE {fys_scope.where} AND name=?", fys_scope.params + (fy_name,))
 		row = cursor.fetchone()
 		row = dict(row)
-		cursor.execute(f"""CREATE TABLE IF NOT EXISTS journal_{user_id}_{row.get("id")} (
-			id INTEGER PRIMARY KEY UNIQUE NOT NULL,
-			date TEXT NOT NULL,
-			ac_debited TEXT NOT NULL,
-			ac_credited TEXT NOT NULL,
-			amount INTEGER NOT NULL,
-			description TEXT NOT NULL
-		)""")
-		cursor.execute(f"""CREATE TABLE IF NOT EXISTS bs_{user_id}_{row.get("id")} (
-			id INTEGER PRIMARY KEY UNIQUE NOT NULL,
-			account TEXT NOT NULL,
-			type TEXT NOT NULL,
-			subtype TEXT NOT NULL,
-			operation TEXT NOT NULL
-		)""")
+		create_fy_tables(cursor, user_id, row.get("id"))
+		publish(cursor, "fys", user_id)
 		db.commit()
 		db.close()
+		forget_fys(user_id)
 		return jsonify({
 			"success": 1,
 			"row": row
 		}), 200
 	elif request.method == "GET":
-		cursor.execute(f"SELECT * FROM fys_{user_id}")
+		cursor.execute(f"SELECT id, name, status FROM {fys_scope.table} WHERE {fys_scope.where}", fys_scope.params)
 		rows = cursor.fetchall()
 		rows = [dict(row) for row in rows]
+		version = layout(cursor, user_id)
 		db.close()
 		fy_q = request.args.get("fy_q")
 		if rows and fy_q:
-			vectorizer = TfidfVectorizer(analyzer="char_wb", ngram_range=(2, 4))
-			tfidf_matrix = vectorizer.fit_transform([row["name"].lower() for row in rows])
-			query_vec = vectorizer.transform([fy_q.strip().lower()])
-			sim_scores = cosine_similarity(query_vec, tfidf_matrix).flatten()
-			rows = [rows[i] for i in sim_scores.argsort()[::-1] if sim_scores[i] >= 0.3]
-		return jsonify(rows), 200
+			rows = search(("fys", user_id), rows, "name", fy_q)
+		return jsonify(rows), 200, {"X-Layout": str(version)}
 	elif request.method == "PATCH":
 		if signed.get("status") == "closed":
 			db.close()
@@ -129,13 +376,13 @@ def fy():
 			if error:
 				db.close()
 				return jsonify(error), 400
-			cursor.execute(f"SELECT * FROM fys_{user_id} WHERE id=?", (id,))
+			cursor.execute(f"SELECT * FROM {fys_scope.table} WHERE {fys_scope.where} AND id=?", fys_scope.params + (id,))
 			row = cursor.fetchone()
 			if not row:
 				db.close()
 				return jsonify({"error": "Invalid id"}), 400
 			fy_name = request.form.get("fy_name").strip()
-			cursor.execute(f"SELECT * FROM fys_{user_id} WHERE name=? AND id!=?", (fy_name, id))
+			cursor.execute(f"SELECT * FROM {fys_scope.table} WHERE {fys_scope.where} AND name=? AND id!=?", fys_scope.params + (fy_name, id))
 			row = cursor.fetchone()
 			if row:
 				db.close()
@@ -143,18 +390,20 @@ def fy():
 					"error": "Journal already exists",
 					"id": row["id"]
 				}), 400
-			cursor.execute(f"UPDATE fys_{user_id} SET name=? WHERE id=?", (fy_name, id))
+			cursor.execute(f"UPDATE {fys_scope.table} SET name=? WHERE {fys_scope.where} AND id=?", (fy_name,) + fys_scope.params + (id,))
+			publish(cursor, "fys", user_id)
 			db.commit()
 			db.close()
+			forget_fys(user_id)
 			return jsonify({"success": 1}), 200
 		elif purpose == "update_status":
-			cursor.execute(f"SELECT * FROM fys_{user_id} WHERE id=?", (id,))
+			cursor.execute(f"SELECT * FROM {fys_scope.table} WHERE {fys_scope.where} AND id=?", fys_scope.params + (id,))
 			row = cursor.fetchone()
 			if not row:
 				db.close()
 				return jsonify({"error": "Invalid id"}), 400
 			status = dict(row).get("status")
-			cursor.execute(f"UPDATE fys_{user_id} SET status=? WHERE id=?", ("closed" if status == "open" else "open", id))
+			cursor.execute(f"UPDATE {fys_scope.table} SET status=? WHERE {fys_scope.where} AND id=?", ("closed" if status == "open" else "open",) + fys_scope.params + (id,))
 			db.commit()
 			db.close()
 			return jsonify({"success": 1, "status": "closed" if status == "open" else "open"}), 200
@@ -172,51 +421,134 @@ def fy():
 			db.close()
 			return jsonify(error), 400
 		id = request.form.get("id").strip()
-		cursor.execute(f"SELECT * FROM fys_{user_id} WHERE id=?", (id,))
+		cursor.execute(f"SELECT * FROM {fys_scope.table} WHERE {fys_scope.where} AND id=?", fys_scope.params + (id,))
 		row = cursor.fetchone()
 		if not row:
 			db.close()
 			return jsonify({"error": "Invalid id"}), 400
 		row = dict(row)
-		cursor.execute(f"DELETE FROM fys_{user_id} WHERE id=?", (id,))
-		cursor.execute(f"DROP TABLE journal_{user_id}_{row.get("id")}")
-		cursor.execute(f"DROP TABLE bs_{user_id}_{row.get("id")}")
+		cursor.execute(f"DELETE FROM {fys_scope.table} WHERE {fys_scope.where} AND id=?", fys_scope.params + (id,))
+		drop_fy(cursor, user_id, row.get("id"))
+		publish(cursor, "reports", user_id, row.get("id"))
+		publish(cursor, "fys", user_id)
 		db.commit()
 		db.close()
+		evict("ledger", user_id, row.get("id"))
+		forget_fys(user_id)
+		forget_reports(user_id, row.get("id"))
 		return jsonify({"success": 1}), 200
 
+@accounting.route("/archive", methods=["GET", "POST"])
+@accounting.route("/archive/<id>", methods=["GET"])
+def archive(id=None):
+	signed = check_signed(request.cookies)
+	if not signed:
+		return redirect("/auth")
+	db = get_db()
+	cursor = db.cursor()
+	user_id = signed.get("id")
+	create_user_tables(cursor, user_id)
+	db.commit()
+	fys_scope = scopes(cursor, user_id)["fys"]
+	if request.method == "GET":
+		db.execute("BEGIN")
+		if id:
+			cursor.execute(f"SELECT id, name, status FROM {fys_scope.table} WHERE {fys_scope.where} AND id=?", fys_scope.params + (id,))
+		else:
+			cursor.execute(f"SELECT id, name, status FROM {fys_scope.table} WHERE {fys_scope.where} ORDER BY id", fys_scope.params)
+		fys = cursor.fetchall()
+		if id and not fys:
+			db.close()
+			return jsonify({"error": "Invalid id"}), 400
+		name = fys[0][1] if id else signed.get("username")
+		return release_on_close(Response(stream_with_context(gzip_lines(archive_lines(db, cursor, user_id, fys))), mimetype="application/gzip", headers={
+			"Content-Disposition": f"attachment; filename*=UTF-8''{quote(name)}.archive.gz"
+		}))
+	if signed.get("status") == "closed":
+		db.close()
+		return jsonify({"error": "Your account has been closed"}), 400
+	data = request.files.get("data")
+	if not data:
+		db.close()
+		return jsonify({"error": "Field data is empty"}), 400
+	upload = tempfile.TemporaryFile()
+	try:
+		data.save(upload)
+		error = check_archive(read_archive(upload))
+		if not error:
+			db.execute("BEGIN IMMEDIATE")
+			rows = restore(cursor, user_id, read_archive(upload))
+			publish(cursor, "fys", user_id)
+	except (sqlite3.Error, OSError, EOFError, ValueError) as e:
+		print(e)
+		error = "Invalid archive"
+	finally:
+		upload.close()
+	if error:
+		db.close()
+		return jsonify({"error": error}), 400
+	db.commit()
+	db.close()
+	forget_fys(user_id)
+	return jsonify({
+		"success": 1,
+		"rows": rows
+	}), 200
+
 @accounting.route("/journal/<id>", methods=["POST", "GET"])
 def journal(id):
 	signed = check_signed(request.cookies)
 	if not signed:
 		return redirect("/auth")
-	db = sqlite3.connect("data.db")
+	db = get_db()
 	cursor = db.cursor()
 	cursor.row_factory = sqlite3.Row
-	cursor.execute("SELECT id FROM users WHERE token=?", (request.cookies.get("user_token"),))
-	user_id = dict(cursor.fetchone()).get("id")
-	cursor.execute(f"SELECT * FROM fys_{user_id} WHERE id=?", (id,))
+	user_id = signed.get("id")
+	error = check_layout(cursor, user_id)
+	if error:
+		db.close()
+		return jsonify(error), 409
+	fys_scope = scopes(cursor, user_id)["fys"]
+	cursor.execute(f"SELECT id, name, status FROM {fys_scope.table} WHERE {fys_scope.where} AND id=?", fys_scope.params + (id,))
 	row = cursor.fetchone()
 	if not row:
 		db.close()
 		return jsonify({"error": "Invalid id"}), 400
 	row = dict(row)
 	status = row.get("status")
+	tables = scopes(cursor, user_id, row["id"])
+	journal_scope, balances_scope, periods_scope = tables["journal"], tables["balances"], tables["periods"]
 	if request.method == "GET":
-		cursor.execute(f"SELECT * FROM journal_{user_id}_{row.get("id")}")
-		rows = cursor.fetchall()
-		rows = [dict(row) for row in rows]
-		total = 0
-		if rows:
-			cursor.execute(f"SELECT SUM(amount) FROM journal_{user_id}_{row.get("id")}")
-			total = cursor.fetchone()
-			total = total[0] if total and total[0] is not None else 0
+		error = check_journal_args(request.args)
+		if error:
+			db.close()
+			return jsonify(error), 400
+		check_balances(cursor, user_id, row.get("id"))
+		cursor.execute(f"SELECT COALESCE(SUM(debit), 0) FROM {balances_scope.table} WHERE {balances_scope.where}", balances_scope.params)
+		total = cursor.fetchone()[0]
+		where, params = journal_where(journal_scope, request.args)
+		limit = int(request.args.get("limit")) if request.args.get("limit") else None
+		cursor.execute(f"SELECT id, date, ac_debited, ac_credited, amount, description FROM {journal_scope.table} WHERE {where} ORDER BY id", params)
+		if request.args.get("format") == "ndjson":
+			return release_on_close(Response(stream_with_context(journal_lines(db, cursor, row.get("name"), total, limit)), mimetype="application/x-ndjson"))
+		rows = [dict(entry) for entry in (cursor.fetchmany(limit + 1) if limit else cursor)]
+		next_id = None
+		if limit and len(rows) > limit:
+			rows = rows[:limit]
+			next_id = rows[-1]["id"]
+		page_total = sum([entry["amount"] for entry in rows])
+		for entry in rows:
+			entry["amount"] = to_display(entry["amount"])
 		db.close()
-		return jsonify({
+		result = {
 			"rows": rows,
-			"total": total,
+			"total": to_display(total),
+			"page_total": to_display(page_total),
 			"fy_name": row.get("name")
-		}), 200
+		}
+		if limit:
+			result["next"] = next_id
+		return jsonify(result), 200
 	elif request.method == "POST":
 		if signed.get("status") == "closed":
 			db.close()
@@ -224,157 +556,248 @@ def journal(id):
 		if status == "closed":
 			db.close()
 			return "", 204
-		required_fields = ["date", "ac_debited", "ac_credited", "amount", "description"]
-		balance = {}
-		for i in range(0, len(request.json)):
-			error = check_fields(request.json[i], required_fields)
-			if error:
-				error["index"] = i
-				return jsonify(error), 400
-			try:
-				amount = float(request.json[i]["amount"])
-			except:
+		check_balances(cursor, user_id, row.get("id"))
+		if isinstance(request.json, list):
+			errors, columns = check_entries(request.json)
+			if errors:
 				db.close()
-				return jsonify({
-					"error": "invalid amount",
-					"field": "amount",
-					"index": i
-				}), 400
-			if amount <= 0:
-				db.close()
-				return jsonify({
-					"error": "invalid amount",
-					"field": "amount",
-					"index": i
-				})
-			date = request.json[i].get("date")
-			try:
-				datetime.strptime(date, "%Y-%m-%d")
-			except:
-				db.close()
-				return jsonify({
-					"error": "invalid date",
-					"field": "date",
-					"index": i
-				}), 400
-		cursor.execute(f"DROP TABLE journal_{user_id}_{row.get("id")}");
-		cursor.execute(f"""CREATE TABLE IF NOT EXISTS journal_{user_id}_{row.get("id")} (
-			id INTEGER PRIMARY KEY UNIQUE NOT NULL,
-			date TEXT NOT NULL,
-			ac_debited TEXT NOT NULL,
-			ac_credited TEXT NOT NULL,
-			amount INTEGER NOT NULL,
-			description TEXT NOT NULL
-		)""")
-		for i in request.json:
-			cursor.execute(f"INSERT INTO journal_{user_id}_{row.get("id")} (date, ac_debited, ac_credited, amount, description) VALUES(?, ?, ?, ?, ?)",
-				(i["date"].strip(), i["ac_debited"].strip(), i["ac_credited"].strip(), i["amount"].strip(), i["description"].strip()))
+				return jsonify(errors), 400
+			cursor.execute(f"DELETE FROM {journal_scope.table} WHERE {journal_scope.where}", journal_scope.params)
+			cursor.executemany(f"INSERT INTO {journal_scope.table} ({journal_scope.columns}date, ac_debited, ac_credited, amount, description) VALUES({journal_scope.values}?, ?, ?, ?, ?)",
+				[journal_scope.params + i for i in zip(*[columns[field] for field in entry_fields])])
+			rebuild_balances(cursor, tables)
+			publish(cursor, "reports", user_id, row.get("id"))
+			db.commit()
+			db.close()
+			forget_reports(user_id, row.get("id"))
+			forget_ledgers(user_id, row.get("id"))
+			return jsonify({"success": 1}), 200
+		if not isinstance(request.json, dict):
+			db.close()
+			return jsonify({"error": "Invalid journal"}), 400
+		inserted_errors, inserted = check_entries(request.json.get("inserted", []), "inserted")
+		updated_errors, updated = check_entries(request.json.get("updated", []), "updated", ids=True)
+		deleted_errors, deleted = check_ids(request.json.get("deleted", []), "deleted")
+		errors = inserted_errors + updated_errors + deleted_errors
+		if errors:
+			db.close()
+			return jsonify(errors), 400
+		deleted = list(dict.fromkeys(deleted))
+		removed = set(deleted)
+		updated = {i[0]: i[1:] for i in zip(*[updated[field] for field in ["id"] + entry_fields]) if i[0] not in removed}
+		updated_ids = list(updated.keys())
+		db.execute("BEGIN IMMEDIATE")
+		update_balances(cursor, tables, deleted + updated_ids, "-")
+		cursor.executemany(f"DELETE FROM {journal_scope.table} WHERE {journal_scope.where} AND id=?",
+			[journal_scope.params + (i,) for i in deleted])
+		missing = cursor.rowcount != len(deleted)
+		cursor.executemany(f"UPDATE {journal_scope.table} SET date=?, ac_debited=?, ac_credited=?, amount=?, description=? WHERE {journal_scope.where} AND id=?",
+			[values + journal_scope.params + (id,) for id, values in updated.items()])
+		if missing or cursor.rowcount != len(updated):
+			db.rollback()
+			db.close()
+			return jsonify({"error": "Some entries were changed elsewhere, reload the journal"}), 409
+		inserted = [journal_scope.params + i for i in zip(*[inserted[field] for field in entry_fields])]
+		cursor.executemany(f"INSERT INTO {journal_scope.table} ({journal_scope.columns}date, ac_debited, ac_credited, amount, description) VALUES({journal_scope.values}?, ?, ?, ?, ?)", inserted)
+		inserted_ids = []
+		if inserted:
+			cursor.execute("SELECT seq FROM sqlite_sequence WHERE name=?", (journal_scope.table,))
+			last_id = cursor.fetchone()[0]
+			inserted_ids = list(range(last_id - len(inserted) + 1, last_id + 1))
+		update_balances(cursor, tables, updated_ids + inserted_ids, "")
+		cursor.execute(f"DELETE FROM {balances_scope.table} WHERE {balances_scope.where} AND entries<=0", balances_scope.params)
+		cursor.execute(f"DELETE FROM {periods_scope.table} WHERE {periods_scope.where} AND entries<=0", periods_scope.params)
+		publish(cursor, "reports", user_id, row.get("id"))
 		db.commit()
 		db.close()
-		return jsonify({"success": 1}), 200
+		forget_reports(user_id, row.get("id"))
+		forget_ledgers(user_id, row.get("id"))
+		return jsonify({
+			"success": 1,
+			"inserted": inserted_ids
+		}), 200
+
+@accounting.route("/journal/<id>/import", methods=["POST"])
+def journal_import(id):
+	signed = check_signed(request.cookies)
+	if not signed:
+		return redirect("/auth")
+	data = request.files.get("data")
+	if not data:
+		return jsonify({"error": "Field data is empty"}), 400
+	kind = file_kind(data.filename)
+	if kind == "xlsx" and not find_spec("openpyxl"):
+		return jsonify({"error": "XLSX import is not available"}), 400
+	db = get_db()
+	cursor = db.cursor()
+	user_id = signed.get("id")
+	error = check_layout(cursor, user_id)
+	if error:
+		db.close()
+		return jsonify(error), 409
+	fys_scope = scopes(cursor, user_id)["fys"]
+	cursor.execute(f"SELECT id, status FROM {fys_scope.table} WHERE {fys_scope.where} AND id=?", fys_scope.params + (id,))
+	row = cursor.fetchone()
+	if not row:
+		db.close()
+		return jsonify({"error": "Invalid id"}), 400
+	if signed.get("status") == "closed" or row[1] == "closed":
+		db.close()
+		return "", 204
+	check_balances(cursor, user_id, row[0])
+	tables = scopes(cursor, user_id, row[0])
+	upload = tempfile.TemporaryFile()
+	data.save(upload)
+	return release_on_close(Response(stream_with_context(import_lines(db, cursor, tables, upload, kind, (user_id, row[0]))), mimetype="application/x-ndjson"))
 
 @accounting.route("/ledger/<id>", methods=["GET"])
 def ledger(id):
-	if not check_signed(request.cookies):
+	signed = check_signed(request.cookies)
+	if not signed:
 		return redirect("/auth")
-	db = sqlite3.connect("data.db")
+	db = get_db()
 	cursor = db.cursor()
 	cursor.row_factory = sqlite3.Row
-	cursor.execute("SELECT id FROM users WHERE token=?", (request.cookies.get("user_token"),))
-	user_id = dict(cursor.fetchone()).get("id")
-	cursor.execute(f"SELECT id FROM fys_{user_id} WHERE id=?", (id,))
+	user_id = signed.get("id")
+	error = check_layout(cursor, user_id)
+	if error:
+		db.close()
+		return jsonify(error), 409
+	fys_scope = scopes(cursor, user_id)["fys"]
+	cursor.execute(f"SELECT id FROM {fys_scope.table} WHERE {fys_scope.where} AND id=?", fys_scope.params + (id,))
 	row = cursor.fetchone()
 	if not row:
 		db.close()
 		return jsonify({"error": "Invalid id"}), 400
 	row = dict(row)
+	tables = scopes(cursor, user_id, row["id"])
+	journal_scope, bs_scope, balances_scope = tables["journal"], tables["bs"], tables["balances"]
+	check_balances(cursor, user_id, row["id"])
 	account = request.args.get("account")
 	if request.method == "GET":
 		if not account:
-			cursor.execute(f"""
-				SELECT ac_debited AS account FROM journal_{user_id}_{row["id"]}
-				UNION SELECT ac_credited AS account FROM journal_{user_id}_{row["id"]}
-			""")
+			cursor.execute(f"""SELECT balances.account, bs.operation, bs.type, bs.subtype
+				FROM (SELECT account FROM {balances_scope.table} WHERE {balances_scope.where}) AS balances
+				LEFT JOIN (SELECT * FROM {bs_scope.table} WHERE {bs_scope.where}) AS bs ON bs.account=balances.account
+				ORDER BY balances.account
+			""", balances_scope.params + bs_scope.params)
 			rows = cursor.fetchall()
 			rows = [dict(row) for row in rows]
 			ledger_q = request.args.get("ledger_q")
 			if rows and ledger_q:
-				vectorizer = TfidfVectorizer(analyzer="char_wb", ngram_range=(2, 4))
-				tfidf_matrix = vectorizer.fit_transform([row["account"].lower() for row in rows])
-				query_vec = vectorizer.transform([ledger_q.strip().lower()])
-				sim_scores = cosine_similarity(query_vec, tfidf_matrix).flatten()
-				rows = [rows[i] for i in sim_scores.argsort()[::-1] if sim_scores[i] >= 0.3]
-			cursor.execute(f"SELECT * FROM bs_{user_id}_{row["id"]}")
-			bss = cursor.fetchall()
-			bss = [dict(bs) for bs in bss]
+				rows = search(("ledger", user_id, row["id"]), rows, "account", ledger_q)
 			for i in range(len(rows)):
-				for j in range(len(bss)):
-					if rows[i].get("account") == bss[j].get("account"):
-						rows[i]["operation"] = bss[j].get("operation")
-						rows[i]["type"] = bss[j].get("type")
-						rows[i]["subtype"] = bss[j].get("subtype")
-						break
-				if not rows[i].get("operation") or not rows[i].get("type") or not rows[i].get("subtype"):
-					rows[i]["operation"] = None
-					rows[i]["type"] = None
-					rows[i]["subtype"] = None
 				rows[i]["id"] = i
 			db.close()
 			return jsonify(rows), 200
-		balance = 0
-		cursor.execute(f"SELECT id,date,ac_credited AS account,amount FROM journal_{user_id}_{row["id"]} WHERE ac_debited=?", (account,))
-		debit_side = cursor.fetchall()
-		debit_total = 0
-		if debit_side:
-			debit_side = [dict(row) for row in debit_side]
-			debit_total = sum([row["amount"] for row in debit_side])
-			balance += debit_total
-		cursor.execute(f"SELECT id,date,ac_debited AS account,amount FROM journal_{user_id}_{row["id"]} WHERE ac_credited=?", (account,))
-		credit_side = cursor.fetchall()
-		credit_total = 0
-		if credit_side:
-			credit_side = [dict(row) for row in credit_side]
-			credit_total = sum([row["amount"] for row in credit_side])
-			balance -= credit_total
-		db.close()
-		if not debit_side and not credit_side:
+		error = check_dates(request.args, ["from", "to", "as_of"])
+		if error:
+			db.close()
+			return jsonify(error), 400
+		cursor.execute(f"SELECT debit, credit FROM {balances_scope.table} WHERE {balances_scope.where} AND account=?", balances_scope.params + (account,))
+		totals = cursor.fetchone()
+		if not totals:
+			db.close()
 			return jsonify({"error": "invalid account"}), 400
+		start = request.args.get("from")
+		end = request.args.get("to") or request.args.get("as_of")
+		date_where, date_params = "", ()
+		if start:
+			date_where += " AND date>=?"
+			date_params += (start,)
+		if end:
+			date_where += " AND date<=?"
+			date_params += (end,)
+		cursor.execute(f"SELECT id,date,ac_credited AS account,amount FROM {journal_scope.table} WHERE {journal_scope.where} AND ac_debited=?{date_where} ORDER BY date, id", journal_scope.params + (account,) + date_params)
+		debit_side = [dict(row) for row in cursor.fetchall()]
+		cursor.execute(f"SELECT id,date,ac_debited AS account,amount FROM {journal_scope.table} WHERE {journal_scope.where} AND ac_credited=?{date_where} ORDER BY date, id", journal_scope.params + (account,) + date_params)
+		credit_side = [dict(row) for row in cursor.fetchall()]
+		opening = 0
+		if start:
+			query, params = balances_before(tables, start, account)
+			cursor.execute(query, params)
+			before = cursor.fetchone()
+			opening = before["debit"] - before["credit"] if before else 0
+		if start or end:
+			cursor.execute(f"""SELECT
+				(SELECT COALESCE(SUM(amount), 0) FROM {journal_scope.table} WHERE {journal_scope.where} AND ac_debited=?{date_where}),
+				(SELECT COALESCE(SUM(amount), 0) FROM {journal_scope.table} WHERE {journal_scope.where} AND ac_credited=?{date_where})
+			""", journal_scope.params + (account,) + date_params + journal_scope.params + (account,) + date_params)
+			totals = cursor.fetchone()
+			debit_total = totals[0] + max(opening, 0)
+			credit_total = totals[1] + max(-opening, 0)
+		else:
+			debit_total = totals["debit"]
+			credit_total = totals["credit"]
+		db.close()
+		for i in debit_side + credit_side:
+			i["amount"] = to_display(i["amount"])
+		balance = debit_total - credit_total
 		balance_side = None
 		if balance > 0:
 			balance_side = "credit_side"
 		if balance < 0:
 			balance_side = "debit_side"
-		total = 0
-		if debit_total and credit_total:
-			total = debit_total if debit_total > credit_total else credit_total
-		if not debit_total:
-			total = credit_total
-		if not credit_total:
-			total = debit_total
-		return jsonify({
+		total = max(debit_total, credit_total)
+		result = {
 			"debit_side": debit_side,
 			"credit_side": credit_side,
 			"balance_side": balance_side,
-			"balance": abs(balance),
-			"total": total
-		}), 200
+			"balance": to_display(abs(balance)),
+			"total": to_display(total)
+		}
+		if start:
+			result["opening"] = to_display(abs(opening))
+			result["opening_side"] = "debit_side" if opening > 0 else "credit_side" if opening < 0 else None
+		return jsonify(result), 200
+
+@accounting.route("/ledgers/<id>", methods=["GET"])
+def ledgers(id):
+	signed = check_signed(request.cookies)
+	if not signed:
+		return redirect("/auth")
+	db = get_db()
+	cursor = db.cursor()
+	user_id = signed.get("id")
+	error = check_layout(cursor, user_id)
+	if error:
+		db.close()
+		return jsonify(error), 409
+	fys_scope = scopes(cursor, user_id)["fys"]
+	cursor.execute(f"SELECT id, name FROM {fys_scope.table} WHERE {fys_scope.where} AND id=?", fys_scope.params + (id,))
+	row = cursor.fetchone()
+	if not row:
+		db.close()
+		return jsonify({"error": "Invalid id"}), 400
+	fy_id, fy_name = row
+	journal_scope = scopes(cursor, user_id, fy_id)["journal"]
+	files = ledger_files(db, cursor, journal_scope, fy_name)
+	return release_on_close(Response(stream_with_context(zip_stream(files)), mimetype="application/zip", headers={
+		"Content-Disposition": f"attachment; filename*=UTF-8''{quote(f'{fy_name}_ledgers.zip')}"
+	}))
 
 @accounting.route("/bs/<fy_id>", methods=["GET", "PATCH"])
 def bs(fy_id):
 	signed = check_signed(request.cookies)
 	if not signed:
 		return redirect("/auth")
-	db = sqlite3.connect("data.db")
+	db = get_db()
 	cursor = db.cursor()
 	cursor.row_factory = sqlite3.Row
-	cursor.execute("SELECT id FROM users WHERE token=?", (request.cookies.get("user_token"),))
-	user_id = dict(cursor.fetchone()).get("id")
-	cursor.execute(f"SELECT * FROM fys_{user_id} WHERE id=?", (fy_id,))
+	user_id = signed.get("id")
+	error = check_layout(cursor, user_id)
+	if error:
+		db.close()
+		return jsonify(error), 409
+	fys_scope = scopes(cursor, user_id)["fys"]
+	cursor.execute(f"SELECT id, name, status FROM {fys_scope.table} WHERE {fys_scope.where} AND id=?", fys_scope.params + (fy_id,))
 	row = cursor.fetchone()
 	if not row:
 		db.close()
 		return jsonify({"error": "Invalid id"}), 400
 	row = dict(row)
+	tables = scopes(cursor, user_id, row["id"])
+	bs_scope, balances_scope = tables["bs"], tables["balances"]
 	status = row.get("status")
 	if signed.get("status") == "closed":
 		db.close()
@@ -382,108 +805,62 @@ def bs(fy_id):
 	if status == "closed":
 		db.close()
 		return "", 204
+	check_balances(cursor, user_id, row["id"])
 	if request.method == "GET":
-		cursor.execute(f"SELECT account, operation, subtype FROM bs_{user_id}_{row["id"]} WHERE type=?", ("asset",))
-		assets = cursor.fetchall()
-		assets_total = 0
-		current_assets = []
-		current_assets_total = 0
-		noncurrent_assets = []
-		noncurrent_assets_total = 0
-		if assets:
-			assets = [dict(row) for row in assets]
-			i = 0
-			assets_len = len(assets)
-			while i < assets_len:
-				account = assets[i].get("account")
-				cursor.execute(f"SELECT * FROM journal_{user_id}_{row.get("id")} WHERE ac_credited=? OR ac_debited=? LIMIT 1", (account, account))
-				ac_test = cursor.fetchone()
-				if not ac_test:
-					del assets[i]
-					cursor.execute(f"DELETE FROM bs_{user_id}_{row.get("id")} WHERE account=?", (account,))
-					db.commit()
-					assets_len -= 1
-					continue
-				cursor.execute(f"""SELECT
-					COALESCE ((SELECT SUM(amount) FROM journal_{user_id}_{row["id"]} WHERE ac_debited=?), 0)
-					- COALESCE ((SELECT SUM(amount) FROM journal_{user_id}_{row["id"]} WHERE ac_credited=?), 0)
-					AS balance
-				""", (account, account))
-				balance = cursor.fetchone()
-				assets[i]["amount"] = abs(balance["balance"])
-				if assets[i].get("subtype") == "current":
-					current_assets.append(assets[i])
-				else:
-					noncurrent_assets.append(assets[i])
-				i += 1
-			if current_assets:
-				current_assets_total = sum([row["amount"] for row in current_assets if row["operation"] == "add"]) - sum([row["amount"] for row in current_assets if row["operation"] == "less"])
-			if noncurrent_assets:
-				noncurrent_assets_total = sum([row["amount"] for row in noncurrent_assets if row["operation"] == "add"]) - sum([row["amount"] for row in noncurrent_assets if row["operation"] == "less"])
-			if assets:
-				assets_total = current_assets_total + noncurrent_assets_total
-		assets = {
-			"current": current_assets,
-			"current_total": current_assets_total,
-			"noncurrent": noncurrent_assets,
-			"noncurrent_total": noncurrent_assets_total,
-			"total": assets_total
+		error = check_dates(request.args, ["as_of"])
+		if error:
+			db.close()
+			return jsonify(error), 400
+		cursor.execute(f"""DELETE FROM {bs_scope.table} WHERE {bs_scope.where} AND account NOT IN (
+			SELECT account FROM {balances_scope.table} WHERE {balances_scope.where}
+		)""", bs_scope.params + balances_scope.params)
+		if cursor.rowcount:
+			db.commit()
+		balances_query, balances_params = f"SELECT * FROM {balances_scope.table} WHERE {balances_scope.where}", balances_scope.params
+		if request.args.get("as_of"):
+			balances_query, balances_params = balances_before(tables, next_day(request.args.get("as_of")))
+		cursor.execute(f"""SELECT bs.account, bs.type, bs.operation, bs.subtype, balances.debit-balances.credit AS balance
+			FROM (SELECT * FROM {bs_scope.table} WHERE {bs_scope.where}) AS bs
+			JOIN ({balances_query}) AS balances ON balances.account=bs.account
+			WHERE bs.type IN (?, ?)
+			ORDER BY bs.id
+		""", bs_scope.params + balances_params + ("asset", "liability"))
+		rows = cursor.fetchall()
+		db.close()
+		groups = {
+			"asset": {"current": [], "noncurrent": []},
+			"liability": {"current": [], "noncurrent": [], "equity": []}
 		}
-		cursor.execute(f"SELECT account, operation, subtype FROM bs_{user_id}_{row["id"]} WHERE type=?", ("liability",))
-		liabilities = cursor.fetchall()
-		liabilities_total = 0
-		current_liabilities = []
-		current_liabilities_total = 0
-		noncurrent_liabilities = []
-		noncurrent_liabilities_total = 0
-		equity = []
-		equity_total = 0
-		if liabilities:
-			liabilities = [dict(row) for row in liabilities]
-			i = 0
-			liabilities_len = len(liabilities)
-			while i < liabilities_len:
-				account = liabilities[i].get("account")
-				cursor.execute(f"SELECT * FROM journal_{user_id}_{row.get("id")} WHERE ac_credited=? OR ac_debited=? LIMIT 1", (account, account))
-				ac_test = cursor.fetchone()
-				if not ac_test:
-					del liabilities[i]
-					cursor.execute(f"DELETE FROM bs_{user_id}_{row.get("id")} WHERE account=?", (account,))
-					db.commit()
-					liabilities_len -= 1
-					continue
-				cursor.execute(f"""SELECT
-					COALESCE ((SELECT SUM(amount) FROM journal_{user_id}_{row["id"]} WHERE ac_debited=?), 0)
-					- COALESCE ((SELECT SUM(amount) FROM journal_{user_id}_{row["id"]} WHERE ac_credited=?), 0)
-					AS balance
-				""", (account, account))
-				balance = cursor.fetchone()
-				liabilities[i]["amount"] = abs(balance["balance"])
-				if liabilities[i].get("subtype") == "current":
-					current_liabilities.append(liabilities[i])
-				elif liabilities[i].get("subtype") == "noncurrent":
-					noncurrent_liabilities.append(liabilities[i])
+		for i in rows:
+			account = {
+				"account": i["account"],
+				"operation": i["operation"],
+				"subtype": i["subtype"],
+				"amount": abs(i["balance"])
+			}
+			if i["type"] == "asset":
+				groups["asset"]["current" if i["subtype"] == "current" else "noncurrent"].append(account)
+			elif i["subtype"] in ("current", "noncurrent"):
+				groups["liability"][i["subtype"]].append(account)
+			else:
+				groups["liability"]["equity"].append(account)
+		assets = {}
+		for subtype, accounts in groups["asset"].items():
+			assets[subtype] = accounts
+			assets[f"{subtype}_total"] = bs_total(accounts)
+		assets["total"] = assets["current_total"] + assets["noncurrent_total"]
+		liabilities = {}
+		for subtype, accounts in groups["liability"].items():
+			liabilities[subtype] = accounts
+			liabilities[f"{subtype}_total"] = bs_total(accounts)
+		liabilities["total"] = liabilities["current_total"] + liabilities["noncurrent_total"] + liabilities["equity_total"]
+		for group in [assets, liabilities]:
+			for key, value in group.items():
+				if isinstance(value, list):
+					for account in value:
+						account["amount"] = to_display(account["amount"])
 				else:
-					equity.append(liabilities[i])
-				i += 1
-			if current_liabilities:
-				current_liabilities_total = sum([row["amount"] for row in current_liabilities if row["operation"] == "add"]) - sum([row["amount"] for row in current_liabilities if row["operation"] == "less"])
-			if noncurrent_liabilities:
-				noncurrent_liabilities_total = sum([row["amount"] for row in noncurrent_liabilities if row["operation"] == "add"]) - sum([row["amount"] for row in noncurrent_liabilities if row["operation"] == "less"])
-			if equity:
-				equity_total = sum([row["amount"] for row in equity if row["operation"] == "add"]) - sum([row["amount"] for row in equity if row["operation"] == "less"])
-			if liabilities:
-				liabilities_total = current_liabilities_total + noncurrent_liabilities_total + equity_total
-		liabilities = {
-			"current": current_liabilities,
-			"current_total": current_liabilities_total,
-			"noncurrent": noncurrent_liabilities,
-			"noncurrent_total": noncurrent_liabilities_total,
-			"equity": equity,
-			"equity_total": equity_total,
-			"total": liabilities_total
-		}
-		db.close()
+					group[key] = to_display(value)
 		return jsonify({
 			"assets": assets,
 			"liabilities": liabilities
@@ -511,29 +888,56 @@ def bs(fy_id):
 			db.close()
 			return jsonify({"error": "Invalid operation"}), 400
 		account = request.form.get("account").strip()
-		cursor.execute(f"SELECT * FROM journal_{user_id}_{row.get("id")} WHERE ac_credited=? OR ac_debited=? LIMIT 1", (account, account))
+		cursor.execute(f"SELECT * FROM {balances_scope.table} WHERE {balances_scope.where} AND account=?", balances_scope.params + (account,))
 		ac_test = cursor.fetchone()
 		if not ac_test:
 			db.close()
 			return jsonify({"error": "Invalid account"}), 400
-		cursor.execute(f"SELECT * FROM bs_{user_id}_{row.get("id")} WHERE account=?", (account,))
+		cursor.execute(f"SELECT * FROM {bs_scope.table} WHERE {bs_scope.where} AND account=?", bs_scope.params + (account,))
 		bs = cursor.fetchone()
 		if bs:
 			if type == "nota":
-				cursor.execute(f"DELETE FROM bs_{user_id}_{row.get("id")} WHERE account=?", (account,))	
+				cursor.execute(f"DELETE FROM {bs_scope.table} WHERE {bs_scope.where} AND account=?", bs_scope.params + (account,))	
 			elif bs["type"] == type and bs["subtype"] == subtype and bs["operation"] == operation:
 				db.close()
 				return "", 204
 			else:
-				cursor.execute(f"UPDATE bs_{user_id}_{row.get("id")} SET type=?, subtype=?, operation=? WHERE account=?", (type, subtype, operation, account))
+				cursor.execute(f"UPDATE {bs_scope.table} SET type=?, subtype=?, operation=? WHERE {bs_scope.where} AND account=?", (type, subtype, operation) + bs_scope.params + (account,))
 		else:
 			if type != "nota":
-				cursor.execute(f"INSERT INTO bs_{user_id}_{row.get("id")} (account, type, subtype, operation) VALUES(?, ?, ?, ?)", (account, type, subtype, operation))
+				cursor.execute(f"INSERT INTO {bs_scope.table} ({bs_scope.columns}account, type, subtype, operation) VALUES({bs_scope.values}?, ?, ?, ?)", bs_scope.params + (account, type, subtype, operation))
+		publish(cursor, "reports", user_id, row["id"])
 		db.commit()
 		db.close()
+		forget_reports(user_id, row["id"])
 		return jsonify({
 			"success": 1,
 			"type": type,
 			"subtype": subtype,
 			"operation": operation
-		}), 200
\ No newline at end of file
+		}), 200
+
+@accounting.route("/reports/<id>/<name>", methods=["GET"])
+def reports(id, name):
+	signed = check_signed(request.cookies)
+	if not signed:
+		return redirect("/auth")
+	if name not in ["trial_balance", "profit_and_loss"]:
+		return jsonify({"error": "Invalid report"}), 400
+	db = get_db()
+	cursor = db.cursor()
+	user_id = signed.get("id")
+	error = check_layout(cursor, user_id)
+	if error:
+		db.close()
+		return jsonify(error), 409
+	fys_scope = scopes(cursor, user_id)["fys"]
+	cursor.execute(f"SELECT id FROM {fys_scope.table} WHERE {fys_scope.where} AND id=?", fys_scope.params + (id,))
+	row = cursor.fetchone()
+	if not row:
+		db.close()
+		return jsonify({"error": "Invalid id"}), 400
+	fy_id = row[0]
+	result = report(cursor, scopes(cursor, user_id, fy_id), (user_id, fy_id), name)
+	db.close()
+	return jsonify(result), 200
\ No newline at end of file
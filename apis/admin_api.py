@@ -1,38 +1,27 @@
-from apis.authentication_api import check_fields, check_signed
-import bcrypt, pyclamd, os, sqlite3
+from apis.authentication_api import check_fields, check_signed, create_auth_tables, forget_session, revoke_sessions
+from apis.db import get_db
+from apis.hashing import hash_metrics, rounds
+from apis.invalidation import create_invalidations_table, publish
+from apis.mailer import mail_metrics
+from apis.ratelimit import rate_metrics
+from apis.reports import forget_reports
+from apis.scanner import virus_scan
+from apis.schema import drop_user, setup
+from apis.search_index import evict, forget_users, search
+from apis.streaming import gzip_stream
+import bcrypt, os, sqlite3, tempfile, zlib
 from dotenv import load_dotenv
-from flask import Blueprint, current_app, jsonify, redirect, render_template, request, send_file
-from io import BytesIO
-import numpy as np
-from sklearn.feature_extraction.text import TfidfVectorizer
-from sklearn.metrics.pairwise import cosine_similarity
+from flask import Blueprint, jsonify, redirect, render_template, request, Response
 
 load_dotenv()
 
-db = sqlite3.connect("data.db")
-cursor = db.cursor()
-cursor.row_factory = sqlite3.Row
-cursor.execute("SELECT * FROM users WHERE username='admin'")
-row = cursor.fetchone()
-if not row:
-	admin_password = bcrypt.hashpw(os.getenv("ADMIN_PASSWORD").encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
-	cursor.execute("INSERT INTO users (username, email, password, token, ip, admin) VALUES(?, ?, ?, ?, ?, ?)",
-		("admin", os.getenv("GMAIL_ADDRESS"), admin_password, 0, 0, 1))
-	db.commit()
-db.close()
-
-def virus_scan(data):
-	try:
-		cd = pyclamd.ClamdUnixSocket()
-		if not cd.ping():
-			raise RuntimeError("ClamAV daemon unresponsive")
-	except Exception:
-		cd = pyclamd.ClamdNetworkSocket()
-		cd.ping()
-	result = cd.scan_stream(BytesIO(data))
-	if result:
-		return list(result.values())[0][1]
-	return None
+def seed_admin(cursor):
+	cursor.execute("SELECT id FROM users WHERE username='admin'")
+	if cursor.fetchone():
+		return
+	admin_password = bcrypt.hashpw(os.getenv("ADMIN_PASSWORD").encode("utf-8"), bcrypt.gensalt(rounds)).decode("utf-8")
+	cursor.execute("INSERT INTO users (username, email, password, ip, admin) VALUES(?, ?, ?, ?, ?)",
+		("admin", os.getenv("GMAIL_ADDRESS"), admin_password, 0, 1))
 
 admin = Blueprint("admin", __name__)
 
@@ -52,7 +41,7 @@ def user():
 		return redirect("/auth")
 	if row.get("username") != "admin":
 		return redirect("/")
-	db = sqlite3.connect("data.db")
+	db = get_db()
 	cursor = db.cursor()
 	cursor.row_factory = sqlite3.Row
 	if request.method == "GET":
@@ -62,11 +51,7 @@ def user():
 		db.close()
 		user_q = request.args.get("user_q")
 		if rows and user_q:
-			vectorizer = TfidfVectorizer(analyzer="char_wb", ngram_range=(2, 4))
-			tfidf_matrix = vectorizer.fit_transform([row["username"].lower() for row in rows])
-			query_vec = vectorizer.transform([user_q.strip().lower()])
-			sim_scores = cosine_similarity(query_vec, tfidf_matrix).flatten()
-			rows = [rows[i] for i in sim_scores.argsort()[::-1] if sim_scores[i] >= 0.3]
+			rows = search(("users",), rows, "username", user_q)
 		return jsonify(rows), 200
 	elif request.method == "PATCH":
 		error = check_fields(request.form, ["id", "purpose"])
@@ -84,8 +69,13 @@ def user():
 			row = dict(row)
 			status = row.get("status")
 			cursor.execute(f"UPDATE users SET status=? WHERE id=?", ("closed" if status == "open" else "open", row.get("id")))
+			if status == "open":
+				revoke_sessions(cursor, row.get("id"))
+			else:
+				publish(cursor, "sessions", "id", row.get("id"))
 			db.commit()
 			db.close()
+			forget_session("id", row.get("id"))
 			return jsonify({"success": 1, "status": "closed" if status == "open" else "open"}), 200
 		else:
 			return jsonify({"error": "Invalid purpose"}), 400
@@ -102,17 +92,32 @@ def user():
 			return jsonify({"error": "Invalid id"}), 400
 		row = dict(row)
 		cursor.execute(f"DELETE FROM users WHERE id=?", (row.get("id"),))
-		cursor.execute(f"SELECT id FROM fys_{row.get("id")}")
-		ids = cursor.fetchall()
-		ids = [dict(i) for i in ids]
-		cursor.execute(f"""DROP TABLE IF EXISTS "fys_{row.get("id")}" """)
-		for i in ids:
-			cursor.execute(f"""DROP TABLE IF EXISTS "journal_{row.get("id")}_{i.get("id")}" """)
-			cursor.execute(f"""DROP TABLE IF EXISTS "bs_{row.get("id")}_{i.get("id")}" """)
+		drop_user(cursor, row.get("id"))
+		revoke_sessions(cursor, row.get("id"))
+		publish(cursor, "reports", row.get("id"))
+		publish(cursor, "users")
 		db.commit()
 		db.close()
+		forget_session("id", row.get("id"))
+		evict("fys", row.get("id"))
+		evict("ledger", row.get("id"))
+		forget_reports(row.get("id"))
+		forget_users()
 		return jsonify({"success": 1}), 200
 
+@admin.route("/metrics", methods=["GET"])
+def metrics():
+	row = check_signed(request.cookies)
+	if not row:
+		return redirect("/auth")
+	if row.get("username") != "admin":
+		return redirect("/")
+	return jsonify({
+		"mail": mail_metrics(),
+		"hashing": hash_metrics(),
+		"rate_limit": rate_metrics()
+	}), 200
+
 @admin.route("/export", methods=["GET"])
 def export_db():
 	row = check_signed(request.cookies)
@@ -120,7 +125,24 @@ def export_db():
 		return redirect("/auth")
 	if row.get("username") != "admin":
 		return redirect("/")
-	return send_file(os.path.join(current_app.root_path, "data.db"), as_attachment=True)
+	fd, path = tempfile.mkstemp(suffix=".db")
+	os.close(fd)
+	snapshot = sqlite3.connect(path)
+	try:
+		get_db().backup(snapshot)
+	except sqlite3.Error as e:
+		print(e)
+		snapshot.close()
+		os.remove(path)
+		return jsonify({"error": "Export failed"}), 500
+	snapshot.close()
+	data = open(path, "rb")
+	os.remove(path)
+	response = Response(gzip_stream(data), mimetype="application/gzip", headers={
+		"Content-Disposition": "attachment; filename=data.db.gz"
+	})
+	response.call_on_close(data.close)
+	return response
 
 @admin.route("/import", methods=["POST"])
 def import_db():
@@ -129,29 +151,34 @@ def import_db():
 		return redirect("/auth")
 	if row.get("username") != "admin":
 		return redirect("/")
-	data = request.files["data"]
+	data = request.files.get("data")
 	if not data:
 		return jsonify({"error": "Field data is empty"}), 400
-	db = sqlite3.connect("data.db")
+	db = get_db()
 	cursor = db.cursor()
 	cursor.row_factory = sqlite3.Row
 	cursor.execute("SELECT * FROM users WHERE username='admin'")
 	admin_data = dict(cursor.fetchone())
+	cursor.execute("SELECT token_hash, user_id, created, expires FROM sessions WHERE user_id=?", (admin_data.get("id"),))
+	admin_sessions = [tuple(i) for i in cursor.fetchall()]
 	db.close()
+	fd, path = tempfile.mkstemp(suffix=".db")
 	try:
-		db = sqlite3.connect(":memory:")
-		raw = data.read()
-		virus  = virus_scan(raw)
+		with os.fdopen(fd, "w+b") as f:
+			virus = virus_scan(data.stream, f)
 		if virus:
 			return jsonify({"error": "Malicious data"}), 400
-		db.deserialize(raw)
-		db.execute("PRAGMA schema_version;")
-		db.close()
-		with open(os.path.join(current_app.root_path, "data.db"), "wb") as f:
-			f.write(raw)
-		db = sqlite3.connect("data.db")
+		upload = sqlite3.connect(path)
+		try:
+			if upload.execute("PRAGMA quick_check;").fetchone()[0] != "ok":
+				return jsonify({"error": "Incompatible data"}), 400
+			upload.backup(get_db())
+		finally:
+			upload.close()
+		db = get_db()
 		cursor = db.cursor()
 		cursor.row_factory = sqlite3.Row
+		create_auth_tables(cursor)
 		cursor.execute("SELECT * FROM users WHERE username='admin'")
 		row = cursor.fetchone()
 		if row:
@@ -160,9 +187,21 @@ def import_db():
 		else:
 			cursor.execute(f"""INSERT INTO users ({",".join([i for i in admin_data.keys()])}) VALUES({",".join(["?" for _ in range(len(admin_data))])})""",
 				tuple([i for i in admin_data.values()]))
+		cursor.executemany("INSERT OR REPLACE INTO sessions (token_hash, user_id, created, expires) VALUES(?, ?, ?, ?)", admin_sessions)
+		setup(cursor)
+		create_invalidations_table(cursor)
+		publish(cursor, "reset")
 		db.commit()
 		db.close()
+		forget_session()
+		evict()
+		forget_reports()
 		return jsonify({"success": 1}), 200
-	except sqlite3.Error as e:
+	except (sqlite3.Error, zlib.error) as e:
+		print(e)
+		return jsonify({"error": "Incompatible data"}), 400
+	except OSError as e:
 		print(e)
-		return jsonify({"error": "Incompatible data"}), 400
\ No newline at end of file
+		return jsonify({"error": "Virus scanner unavailable"}), 503
+	finally:
+		os.remove(path)
\ No newline at end of file
@@ -0,0 +1,121 @@
+from apis.lazy import lazy
+from apis.money import scale
+from apis.schema import create_fy_tables, rebuild_balances, scopes
+from apis.validation import parse_dates
+import gzip, json
+
+np = lazy("numpy")
+
+archive_format = "accounting-archive"
+archive_version = 1
+block_size = 5000
+archive_columns = {
+	"journal": ["date", "ac_debited", "ac_credited", "amount", "description"],
+	"bs": ["account", "type", "subtype", "operation"]
+}
+bs_subtypes = {
+	"asset": ["current", "noncurrent"],
+	"liability": ["current", "noncurrent", "equity"]
+}
+
+def archive_lines(db, cursor, user_id, fys):
+	try:
+		yield {"format": archive_format, "version": archive_version, "scale": scale}
+		for fy_id, name, status in fys:
+			yield {"fy": {"name": name, "status": status}}
+			tables = scopes(cursor, user_id, fy_id)
+			for table, columns in archive_columns.items():
+				scope = tables[table]
+				cursor.execute(f"SELECT {', '.join(columns)} FROM {scope.table} WHERE {scope.where} ORDER BY id", scope.params)
+				while True:
+					rows = cursor.fetchmany(block_size)
+					if not rows:
+						break
+					yield {table: {column: list(values) for column, values in zip(columns, zip(*rows))}}
+	finally:
+		db.close()
+
+def read_archive(data):
+	data.seek(0)
+	with gzip.GzipFile(fileobj=data) as f:
+		for line in f:
+			yield json.loads(line)
+
+def check_block(table, block):
+	columns = archive_columns[table]
+	if not isinstance(block, dict) or any([not isinstance(block.get(i), list) for i in columns]):
+		return "Invalid archive"
+	if len(set([len(block[i]) for i in columns])) != 1:
+		return "Invalid archive"
+	for column in columns:
+		kind = int if column == "amount" else str
+		if any([type(i) is not kind for i in block[column]]):
+			return f"Invalid {column}"
+	if table == "bs":
+		for account, account_type, subtype, operation in zip(*[block[i] for i in columns]):
+			if not account.strip() or subtype not in bs_subtypes.get(account_type, []) or operation not in ["add", "less"]:
+				return "Invalid bs"
+		return None
+	for column in ["ac_debited", "ac_credited", "description"]:
+		if not all([i.strip() for i in block[column]]):
+			return f"Invalid {column}"
+	if block["date"] and not parse_dates(np.array(block["date"], dtype=str)).all():
+		return "Invalid date"
+	if not all([0 < i < 2**63 for i in block["amount"]]):
+		return "Invalid amount"
+	return None
+
+def unique_name(cursor, fys_scope, name):
+	candidate, copy = name, 1
+	while True:
+		cursor.execute(f"SELECT id FROM {fys_scope.table} WHERE {fys_scope.where} AND name=?", fys_scope.params + (candidate,))
+		if not cursor.fetchone():
+			return candidate
+		copy += 1
+		candidate = f"{name} ({copy})"
+
+def check_archive(lines):
+	header = next(lines, None)
+	if not isinstance(header, dict) or header.get("format") != archive_format or header.get("version") != archive_version:
+		return "Invalid archive"
+	if header.get("scale") != scale:
+		return "Incompatible amounts"
+	fy = False
+	for line in lines:
+		if not isinstance(line, dict) or len(line) != 1:
+			return "Invalid archive"
+		key, value = list(line.items())[0]
+		if key == "fy":
+			if not isinstance(value, dict) or not isinstance(value.get("name"), str) or not value["name"].strip() or value.get("status") not in ["open", "closed"]:
+				return "Invalid fy"
+			fy = True
+		elif key in archive_columns and fy:
+			error = check_block(key, value)
+			if error:
+				return error
+		else:
+			return "Invalid archive"
+	return None
+
+def restore(cursor, user_id, lines):
+	next(lines)
+	fys_scope = scopes(cursor, user_id)["fys"]
+	restored, tables = [], None
+	for line in lines:
+		key, value = list(line.items())[0]
+		if key == "fy":
+			if tables:
+				rebuild_balances(cursor, tables)
+			name = unique_name(cursor, fys_scope, value["name"].strip())
+			cursor.execute(f"INSERT INTO {fys_scope.table} ({fys_scope.columns}name, status) VALUES({fys_scope.values}?, ?)", fys_scope.params + (name, value["status"]))
+			fy_id = cursor.lastrowid
+			create_fy_tables(cursor, user_id, fy_id)
+			tables = scopes(cursor, user_id, fy_id)
+			restored.append({"id": fy_id, "name": name, "status": value["status"]})
+		else:
+			scope, columns = tables[key], archive_columns[key]
+			cursor.executemany(f"INSERT INTO {scope.table} ({scope.columns}{', '.join(columns)}) VALUES({scope.values}{', '.join(['?'] * len(columns))})",
+				[scope.params + i for i in zip(*[value[i] for i in columns])])
+	if tables:
+		rebuild_balances(cursor, tables)
+	return restored
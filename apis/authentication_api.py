@@ -1,67 +1,158 @@
+from apis.db import get_db
+from apis.hashing import check_password, hash_password, needs_rehash, rehash
+from apis.invalidation import prune, publish
+from apis.mailer import queue_mail
+from apis.ratelimit import admit
+from apis.search_index import forget_users
+from collections import OrderedDict
 from datetime import datetime
 from dateutil.relativedelta import relativedelta
 from dotenv import load_dotenv
 from flask import Blueprint, current_app, Flask, request, render_template, jsonify, redirect, url_for
 from flask_mail import Mail, Message
-import sqlite3, random, re, os, bcrypt, threading, time, pytz
+import hashlib, math, sqlite3, random, re, os, secrets, threading, time, pytz
 
 load_dotenv()
 
 authentication = Blueprint("authentication", __name__)
 
-current_app.config["MAIL_SERVER"] = "smtp.gmail.com"
-current_app.config["MAIL_PORT"] = 587
-current_app.config["MAIL_USE_TLS"] = True
-current_app.config["MAIL_USE_SSL"] = False
-current_app.config["MAIL_USERNAME"] = os.getenv("GMAIL_ADDRESS")
-current_app.config["MAIL_PASSWORD"] = os.getenv("APP_PASSWORD")
-current_app.config["MAIL_DEFAULT_SENDER"] = os.getenv("GMAIL_ADDRESS")
-mail = Mail(current_app)
+mail = Mail()
 
-db = sqlite3.connect("data.db")
-db.execute("""CREATE TABLE IF NOT EXISTS users (
-	id INTEGER PRIMARY KEY NOT NULL UNIQUE,
-	username TEXT NOT NULL UNIQUE,
-	email TEXT NOT NULL UNIQUE,
-	password TEXT NOT NULL,
-	created DATETIME NOT NULL DEFAULT (datetime('now')),
-	token INTEGER NOT NULL UNIQUE,
-	ip TEXT NOT NULL,
-	status TEXT NOT NULL DEFAULT "open",
-	admin INTEGER NOT NULL DEFAULT 0
-)""")
-db.execute("""CREATE TABLE IF NOT EXISTS signins (
-	id INTEGER PRIMARY KEY NOT NULL UNIQUE,
-	email TEXT NOT NULL,
-	otp INTEGER NOT NULL,
-	token INTEGER NOT NULL UNIQUE
-)""")
-db.execute("""CREATE TABLE IF NOT EXISTS signups (
-	id INTEGER PRIMARY KEY NOT NULL UNIQUE,
-	username TEXT NOT NULL,
-	email TEXT NOT NULL,
-	password TEXT NOT NULL,
-	otp INTEGER NOT NULL,
-	token INTEGER NOT NULL UNIQUE,
-	ip TEXT NOT NULL
-)""")
-db.execute("""CREATE TABLE IF NOT EXISTS resets (
-	id INTEGER PRIMARY KEY NOT NULL UNIQUE,
-	email TEXT NOT NULL,
-	password TEXT NOT NULL,
-	otp INTEGER NOT NULL,
-	token INTEGER NOT NULL UNIQUE
-)""")
-db.commit()
-db.close()
+def mail_config():
+	return {
+		"MAIL_SERVER": os.getenv("MAIL_SERVER", "smtp.gmail.com"),
+		"MAIL_PORT": int(os.getenv("MAIL_PORT", 587)),
+		"MAIL_USE_TLS": os.getenv("MAIL_USE_TLS", "1") == "1",
+		"MAIL_USE_SSL": False,
+		"MAIL_USERNAME": os.getenv("MAIL_USERNAME", os.getenv("GMAIL_ADDRESS")),
+		"MAIL_PASSWORD": os.getenv("APP_PASSWORD"),
+		"MAIL_DEFAULT_SENDER": os.getenv("GMAIL_ADDRESS")
+	}
 
-def db_cleanup(table, token):
-	time.sleep(5*60)
-	db = sqlite3.connect("data.db")
+def create_users_table(cursor, table="users"):
+	cursor.execute(f"""CREATE TABLE IF NOT EXISTS {table} (
+		id INTEGER PRIMARY KEY NOT NULL UNIQUE,
+		username TEXT NOT NULL UNIQUE,
+		email TEXT NOT NULL UNIQUE,
+		password TEXT NOT NULL,
+		created DATETIME NOT NULL DEFAULT (datetime('now')),
+		ip TEXT NOT NULL,
+		status TEXT NOT NULL DEFAULT "open",
+		admin INTEGER NOT NULL DEFAULT 0
+	)""")
+
+def create_auth_tables(cursor):
+	create_users_table(cursor)
+	if "token" in [i[1] for i in cursor.execute("PRAGMA table_info(users)").fetchall()]:
+		create_users_table(cursor, "users_new")
+		cursor.execute("""INSERT INTO users_new (id, username, email, password, created, ip, status, admin)
+			SELECT id, username, email, password, created, ip, status, admin FROM users""")
+		cursor.execute("DROP TABLE users")
+		cursor.execute("ALTER TABLE users_new RENAME TO users")
+	cursor.execute("""CREATE TABLE IF NOT EXISTS sessions (
+		token_hash BLOB PRIMARY KEY NOT NULL,
+		user_id INTEGER NOT NULL,
+		created DATETIME NOT NULL DEFAULT (datetime('now')),
+		expires DATETIME NOT NULL
+	) WITHOUT ROWID""")
+	cursor.execute("CREATE INDEX IF NOT EXISTS sessions_user_id ON sessions (user_id)")
+	cursor.execute("CREATE INDEX IF NOT EXISTS sessions_expires ON sessions (expires)")
+	cursor.execute("""CREATE TABLE IF NOT EXISTS signins (
+		id INTEGER PRIMARY KEY NOT NULL UNIQUE,
+		email TEXT NOT NULL,
+		otp INTEGER NOT NULL,
+		token INTEGER NOT NULL UNIQUE,
+		expires DATETIME NOT NULL
+	)""")
+	cursor.execute("""CREATE TABLE IF NOT EXISTS signups (
+		id INTEGER PRIMARY KEY NOT NULL UNIQUE,
+		username TEXT NOT NULL,
+		email TEXT NOT NULL,
+		password TEXT NOT NULL,
+		otp INTEGER NOT NULL,
+		token INTEGER NOT NULL UNIQUE,
+		ip TEXT NOT NULL,
+		expires DATETIME NOT NULL
+	)""")
+	cursor.execute("""CREATE TABLE IF NOT EXISTS resets (
+		id INTEGER PRIMARY KEY NOT NULL UNIQUE,
+		email TEXT NOT NULL,
+		password TEXT NOT NULL,
+		otp INTEGER NOT NULL,
+		token INTEGER NOT NULL UNIQUE,
+		expires DATETIME NOT NULL
+	)""")
+	for table in ["signins", "signups", "resets"]:
+		if "expires" not in [i[1] for i in cursor.execute(f"PRAGMA table_info({table})").fetchall()]:
+			cursor.execute(f"ALTER TABLE {table} ADD COLUMN expires DATETIME NOT NULL DEFAULT '1970-01-01 00:00:00'")
+		cursor.execute(f"CREATE INDEX IF NOT EXISTS {table}_expires ON {table} (expires)")
+
+otp_ttl = f"+{5*60} seconds"
+sweep_interval = 60
+sweep_batch = 500
+sweeper = None
+sweeper_lock = threading.Lock()
+
+sessions = OrderedDict()
+sessions_lock = threading.Lock()
+session_ttl = 60
+session_cache_size = 1024
+session_days = int(os.getenv("SESSION_DAYS", 30))
+
+def forget_session(field=None, value=None):
+	with sessions_lock:
+		if field is None:
+			sessions.clear()
+			return
+		if field == "token":
+			sessions.pop(value, None)
+			return
+		for token in [i for i, (_, row) in sessions.items() if row.get(field) == value]:
+			del sessions[token]
+
+def token_hash(token):
+	return hashlib.sha256(token.encode("utf-8")).digest()
+
+def create_session(cursor, user_id):
+	token = secrets.token_urlsafe(32)
+	cursor.execute("INSERT INTO sessions (token_hash, user_id, expires) VALUES(?, ?, datetime('now', ?))",
+		(token_hash(token), user_id, f"+{session_days} days"))
+	return token
+
+def revoke_sessions(cursor, user_id):
+	cursor.execute("DELETE FROM sessions WHERE user_id=?", (user_id,))
+	publish(cursor, "sessions", "id", user_id)
+
+def sweep_expired():
+	db = get_db()
 	cursor = db.cursor()
-	cursor.execute(f"DELETE FROM {table} WHERE token=?", (token,))
+	for table, key in [("signins", "id"), ("signups", "id"), ("resets", "id"), ("sessions", "token_hash")]:
+		while True:
+			cursor.execute(f"""DELETE FROM {table} WHERE {key} IN (
+				SELECT {key} FROM {table} WHERE expires <= datetime('now') LIMIT ?
+			)""", (sweep_batch,))
+			db.commit()
+			if cursor.rowcount < sweep_batch:
+				break
+	prune(cursor)
 	db.commit()
 	db.close()
+
+def run_sweeper(app):
+	with app.app_context():
+		while True:
+			time.sleep(sweep_interval)
+			try:
+				sweep_expired()
+			except sqlite3.Error as e:
+				print(e)
+
+def start_sweeper():
+	global sweeper
+	with sweeper_lock:
+		if sweeper is None:
+			sweeper = threading.Thread(target=run_sweeper, args=(current_app._get_current_object(),), daemon=True)
+			sweeper.start()
 	
 def relative_time(dt):
 	now = datetime.now(pytz.utc)
@@ -86,17 +177,41 @@ def check_signed(cookies):
 		return False
 	if not cookies.get("user_token"):
 		return False
-	user_token = request.cookies.get("user_token")
-	db = sqlite3.connect("data.db")
+	user_token = token_hash(request.cookies.get("user_token"))
+	key = user_token.hex()
+	with sessions_lock:
+		cached = sessions.get(key)
+		if cached and cached[0] > time.monotonic():
+			sessions.move_to_end(key)
+			return dict(cached[1])
+	db = get_db()
 	db.row_factory = sqlite3.Row
 	cursor = db.cursor()
-	cursor.execute("SELECT * FROM users WHERE token=?", (user_token,))
+	cursor.execute("""SELECT users.* FROM sessions JOIN users ON users.id=sessions.user_id
+		WHERE sessions.token_hash=? AND sessions.expires > datetime('now')""", (user_token,))
 	row = cursor.fetchone()
 	db.close()
 	if not row:
 		return False
+	row = dict(row)
+	with sessions_lock:
+		sessions[key] = (time.monotonic() + session_ttl, row)
+		sessions.move_to_end(key)
+		while len(sessions) > session_cache_size:
+			sessions.popitem(last=False)
 	return dict(row)
 
+def client_ip():
+	return request.headers.get("X-Forwarded-For", request.remote_addr).split(",")[0].strip()
+
+def check_rate(*accounts):
+	wait = admit(client_ip(), [i.strip().lower() for i in accounts if i and i.strip()])
+	if wait:
+		return jsonify({
+			"error": "Too many attempts, try again later"
+		}), 429, {"Retry-After": str(math.ceil(wait))}
+	return False
+
 def check_fields(form, required_fields):
 	for i in required_fields:
 		if i not in form.keys():
@@ -120,6 +235,9 @@ def index():
 
 @authentication.route("/signin", methods=["POST"])
 def signin():
+	error = check_rate(request.form.get("signin_username_or_email"))
+	if error:
+		return error
 	if check_signed(request.cookies):
 		return redirect("/")
 	required_fields = ["signin_username_or_email", "signin_password"]
@@ -128,7 +246,7 @@ def signin():
 		return error
 	signin_username_or_email = request.form.get("signin_username_or_email").strip()
 	signin_password = request.form.get("signin_password")
-	db = sqlite3.connect("data.db")
+	db = get_db()
 	db.row_factory = sqlite3.Row
 	cursor = db.cursor()
 	cursor.execute("SELECT email, password FROM users WHERE username=? OR email=?",
@@ -143,15 +261,22 @@ def signin():
 	row = dict(row)
 	signin_email = row.get("email")
 	password = row.get("password")
-	if not bcrypt.checkpw(
-		signin_password.encode("utf-8"),
-		password.encode("utf-8")
-	):
+	valid = check_password(signin_password, password)
+	if valid is None:
+		db.close()
+		return jsonify({
+			"error": "The server is busy, try again later"
+		}), 503
+	if not valid:
 		db.close()
 		return jsonify({
 			"error": "The password is invalid",
 			"field": "signin_password"
 		}), 400
+	if needs_rehash(password):
+		password = rehash(signin_password)
+		if password:
+			cursor.execute("UPDATE users SET password=? WHERE email=?", (password, signin_email))
 	while True:
 		signin_token = random.randint(1000000000, 9999999999)
 		cursor.execute("SELECT * FROM signins WHERE token=?", (signin_token,))
@@ -159,17 +284,19 @@ def signin():
 		if not row:
 			break
 	otp = random.randint(100000, 999999)
-	cursor.execute("INSERT INTO signins (email, otp, token) VALUES(?, ?, ?)",
-		(signin_email, otp, signin_token))
+	cursor.execute("INSERT INTO signins (email, otp, token, expires) VALUES(?, ?, ?, datetime('now', ?))",
+		(signin_email, otp, signin_token, otp_ttl))
 	db.commit()
 	db.close()
-	mail.send(Message(
+	start_sweeper()
+	if not queue_mail(mail, Message(
 		subject="OTP for email verification for sign in",
 		recipients=[signin_email],
 		body=f"The OTP for the verification of your email for sign in is {otp}."
-	))
-	t = threading.Thread(target=db_cleanup, args=("signins", signin_token), daemon=True)
-	t.start()
+	)):
+		return jsonify({
+			"error": "The mail server is busy, try again later"
+		}), 503
 	return jsonify({
 		"success": 1,
 		"signin_token": signin_token
@@ -177,6 +304,9 @@ def signin():
 	
 @authentication.route("/signup", methods=["POST"])
 def signup():
+	error = check_rate(request.form.get("signup_username"), request.form.get("signup_email"))
+	if error:
+		return error
 	if check_signed(request.cookies):
 		return redirect("/")
 	required_fields = ["signup_username", "signup_email", "signup_password", "signup_password", "signup_confirm_password"]
@@ -212,7 +342,7 @@ def signup():
 			"error": "The passwords do not match",
 			"field": "signup_confirm_password"
 		}), 400
-	db = sqlite3.connect("data.db")
+	db = get_db()
 	cursor = db.cursor()
 	cursor.execute("SELECT * FROM users WHERE username=?", (signup_username,))
 	row = cursor.fetchone()
@@ -237,19 +367,26 @@ def signup():
 		if not row:
 			break
 	otp = random.randint(100000, 999999)
-	signup_password = bcrypt.hashpw(signup_password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
-	ip = request.headers.get("X-Forwarded-For", request.remote_addr).split(",")[0]
-	cursor.execute("INSERT INTO signups (username, email, password, otp, token, ip) VALUES(?, ?, ?, ?, ?, ?)",
-		(signup_username, signup_email, signup_password, otp, signup_token, ip))
+	signup_password = hash_password(signup_password)
+	if not signup_password:
+		db.close()
+		return jsonify({
+			"error": "The server is busy, try again later"
+		}), 503
+	ip = client_ip()
+	cursor.execute("INSERT INTO signups (username, email, password, otp, token, ip, expires) VALUES(?, ?, ?, ?, ?, ?, datetime('now', ?))",
+		(signup_username, signup_email, signup_password, otp, signup_token, ip, otp_ttl))
 	db.commit()
 	db.close()
-	mail.send(Message(
+	start_sweeper()
+	if not queue_mail(mail, Message(
 		subject="OTP for email verification for sign up",
 		recipients=[signup_email],
 		body=f"The OTP for the verification of your email for sign up is {otp}."
-	))
-	t = threading.Thread(target=db_cleanup, args=("signups", signup_token), daemon=True)
-	t.start()
+	)):
+		return jsonify({
+			"error": "The mail server is busy, try again later"
+		}), 503
 	return jsonify({
 		"success": 1,
 		"signup_token": signup_token
@@ -257,6 +394,9 @@ def signup():
 
 @authentication.route("/reset", methods=["POST"])
 def reset():
+	error = check_rate(request.form.get("reset_username_or_email"))
+	if error:
+		return error
 	if check_signed(request.cookies):
 		return redirect("/")
 	required_fields = ["reset_username_or_email", "reset_password", "reset_confirm_password"]
@@ -264,7 +404,7 @@ def reset():
 	if error:
 		return error
 	reset_username_or_email = request.form.get("reset_username_or_email").strip()
-	db = sqlite3.connect("data.db")
+	db = get_db()
 	cursor = db.cursor()
 	cursor.execute("SELECT email FROM users WHERE username=? OR email=?",
 		(reset_username_or_email, reset_username_or_email))
@@ -300,18 +440,25 @@ def reset():
 		if not row:
 			break
 	otp = random.randint(100000, 999999)
-	reset_password = bcrypt.hashpw(reset_password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
-	cursor.execute("INSERT INTO resets (email, password, otp, token) VALUES(?, ?, ?, ?)",
-		(reset_email[0], reset_password, otp, reset_token))
+	reset_password = hash_password(reset_password)
+	if not reset_password:
+		db.close()
+		return jsonify({
+			"error": "The server is busy, try again later"
+		}), 503
+	cursor.execute("INSERT INTO resets (email, password, otp, token, expires) VALUES(?, ?, ?, ?, datetime('now', ?))",
+		(reset_email[0], reset_password, otp, reset_token, otp_ttl))
 	db.commit()
 	db.close()
-	mail.send(Message(
+	start_sweeper()
+	if not queue_mail(mail, Message(
 		subject="OTP for password reset",
 		recipients=[reset_email[0]],
 		body=f"The OTP for the reset of your password is {otp}."
-	))
-	t = threading.Thread(target=db_cleanup, args=("resets", reset_token), daemon=True)
-	t.start()
+	)):
+		return jsonify({
+			"error": "The mail server is busy, try again later"
+		}), 503
 	return jsonify({
 		"success": 1,
 		"reset_token": reset_token
@@ -319,6 +466,9 @@ def reset():
 
 @authentication.route("/otp", methods=["POST"])
 def otp():
+	error = check_rate(f"otp:{request.form.get('token', '').strip()}")
+	if error:
+		return error
 	if check_signed(request.cookies):
 		return redirect("/")
 	required_fields = ["otp", "token", "type"]
@@ -328,11 +478,11 @@ def otp():
 	otp = request.form.get("otp").strip()
 	token = request.form.get("token").strip()
 	type = request.form.get("type").strip()
-	db = sqlite3.connect("data.db")
+	db = get_db()
 	db.row_factory = sqlite3.Row
 	cursor = db.cursor()
 	if type == "signin":
-		cursor.execute("SELECT * FROM signins WHERE token=?", (token,))
+		cursor.execute("SELECT * FROM signins WHERE token=? AND expires > datetime('now')", (token,))
 		row = cursor.fetchone()
 		if not row:
 			db.close()
@@ -341,28 +491,32 @@ def otp():
 				"field": "otp"
 			}), 400
 		data = dict(row)
-		email = data.get("email")
 		if str(data.get("otp")) != otp:
 			db.close()
 			return jsonify({
 				"error": "The otp is invalid",
 				"field": "otp"
 			}), 400
-		while True:
-			user_token = random.randint(1000000000, 9999999999)
-			cursor.execute("SELECT * FROM users WHERE token=?", (user_token,))
-			row = cursor.fetchone()
-			if not row:
-				break
-		cursor.execute("UPDATE users SET token=? WHERE email=?", (user_token, email))
+		cursor.execute("DELETE FROM signins WHERE token=?", (token,))
+		cursor.execute("SELECT id FROM users WHERE email=?", (data.get("email"),))
+		row = cursor.fetchone()
+		if not row:
+			db.commit()
+			db.close()
+			return jsonify({
+				"error": "Your otp may've expired",
+				"field": "otp"
+			}), 400
+		user_token = create_session(cursor, row[0])
 		db.commit()
 		db.close()
 		return jsonify({
 			"success": 1,
-			"user_token": user_token
+			"user_token": user_token,
+			"max_age": session_days*24*60*60
 		}), 200
 	elif type == "signup":
-		cursor.execute("SELECT * FROM signups WHERE token=?", (token,))
+		cursor.execute("SELECT * FROM signups WHERE token=? AND expires > datetime('now')", (token,))
 		row = cursor.fetchone()
 		if not row:
 			db.close()
@@ -378,22 +532,20 @@ def otp():
 				"field": "otp"
 			}), 400
 		cursor.execute("DELETE FROM signups WHERE token=?", (token,))
-		while True:
-			user_token = random.randint(1000000000, 9999999999)
-			cursor.execute("SELECT * FROM users WHERE token=?", (user_token,))
-			row = cursor.fetchone()
-			if not row:
-				break
-		cursor.execute("INSERT INTO users (username, email, password, token, ip) VALUES(?, ?, ?, ?, ?)",
-			(data.get("username"), data.get("email"), data.get("password"), user_token, data.get("ip")))
+		cursor.execute("INSERT INTO users (username, email, password, ip) VALUES(?, ?, ?, ?)",
+			(data.get("username"), data.get("email"), data.get("password"), data.get("ip")))
+		user_token = create_session(cursor, cursor.lastrowid)
+		publish(cursor, "users")
 		db.commit()
 		db.close()
+		forget_users()
 		return jsonify({
 			"success": 1,
-			"user_token": user_token
+			"user_token": user_token,
+			"max_age": session_days*24*60*60
 		}), 200
 	elif type == "reset":
-		cursor.execute("SELECT * FROM resets WHERE token=?", (token,))
+		cursor.execute("SELECT * FROM resets WHERE token=? AND expires > datetime('now')", (token,))
 		row = cursor.fetchone()
 		if not row:
 			db.close()
@@ -409,19 +561,25 @@ def otp():
 				"field": "otp"
 			}), 400
 		cursor.execute("DELETE FROM resets WHERE token=?", (token,))
-		while True:
-			user_token = random.randint(1000000000, 9999999999)
-			cursor.execute("SELECT * FROM users WHERE token=?", (user_token,))
-			row = cursor.fetchone()
-			if not row:
-				break
-		cursor.execute("UPDATE users SET password=?, token=? WHERE email=?",
-			(data.get("password"), user_token, data.get("email")))
+		cursor.execute("SELECT id FROM users WHERE email=?", (data.get("email"),))
+		row = cursor.fetchone()
+		if not row:
+			db.commit()
+			db.close()
+			return jsonify({
+				"error": "Your otp may've expired",
+				"field": "otp"
+			}), 400
+		cursor.execute("UPDATE users SET password=? WHERE id=?", (data.get("password"), row[0]))
+		revoke_sessions(cursor, row[0])
+		user_token = create_session(cursor, row[0])
 		db.commit()
 		db.close()
+		forget_session("id", row[0])
 		return jsonify({
 			"success": 1,
-			"user_token": user_token
+			"user_token": user_token,
+			"max_age": session_days*24*60*60
 		}), 200
 	else:
 		db.close()
@@ -430,6 +588,19 @@ def otp():
 			"field": "type"
 		}), 400
 
+@authentication.route("/signout", methods=["POST"])
+def signout():
+	if request.cookies.get("user_token"):
+		user_token = token_hash(request.cookies.get("user_token"))
+		db = get_db()
+		cursor = db.cursor()
+		cursor.execute("DELETE FROM sessions WHERE token_hash=?", (user_token,))
+		publish(cursor, "sessions", "token", user_token.hex())
+		db.commit()
+		db.close()
+		forget_session("token", user_token.hex())
+	return jsonify({"success": 1}), 200
+
 if __name__ == "__main__":
 	app.run()
 
@@ -0,0 +1,74 @@
+from dotenv import load_dotenv
+from flask import current_app, g, has_app_context
+import os, queue, sqlite3, threading
+
+load_dotenv()
+
+database = os.getenv("DATABASE", "data.db")
+pool_size = int(os.getenv("DB_POOL_SIZE", 8))
+pools = {}
+pools_lock = threading.Lock()
+
+class PooledConnection(sqlite3.Connection):
+	def close(self):
+		self.rollback()
+
+def connect(path, factory=PooledConnection):
+	db = sqlite3.connect(path, factory=factory, check_same_thread=False)
+	db.execute("PRAGMA journal_mode=WAL")
+	db.execute("PRAGMA synchronous=NORMAL")
+	db.execute("PRAGMA cache_size=-16000")
+	db.execute("PRAGMA busy_timeout=5000")
+	return db
+
+def idle(path):
+	with pools_lock:
+		if path not in pools:
+			pools[path] = queue.Queue(maxsize=pool_size)
+		return pools[path]
+
+def get_db():
+	if not has_app_context():
+		return connect(database, sqlite3.Connection)
+	db = g.get("db")
+	if db is None:
+		path = current_app.config.get("DATABASE", database)
+		try:
+			db = idle(path).get_nowait()
+		except queue.Empty:
+			db = connect(path)
+		g.db = db
+		g.db_path = path
+	db.row_factory = None
+	return db
+
+def give_back(db, path):
+	try:
+		db.rollback()
+		idle(path).put_nowait(db)
+	except (sqlite3.Error, queue.Full):
+		sqlite3.Connection.close(db)
+
+def release_db(exception=None):
+	db = g.pop("db", None)
+	path = g.pop("db_path", None)
+	if db is not None:
+		give_back(db, path)
+
+def release_on_close(response):
+	db = g.pop("db", None)
+	path = g.pop("db_path", None)
+	if db is not None:
+		response.call_on_close(lambda: give_back(db, path))
+	return response
+
+def reset_pool():
+	with pools_lock:
+		idle_pools = list(pools.values())
+		pools.clear()
+	for connections in idle_pools:
+		while True:
+			try:
+				sqlite3.Connection.close(connections.get_nowait())
+			except queue.Empty:
+				break
@@ -0,0 +1,92 @@
+from concurrent.futures import ThreadPoolExecutor
+from dotenv import load_dotenv
+import bcrypt, os, threading, time
+
+load_dotenv()
+
+rounds = int(os.getenv("BCRYPT_ROUNDS", 12))
+worker_count = int(os.getenv("HASH_WORKERS", 2))
+queue_size = int(os.getenv("HASH_QUEUE_SIZE", 16))
+slots = threading.BoundedSemaphore(worker_count + queue_size)
+executor = None
+executor_lock = threading.Lock()
+metrics = {
+	"hashed": 0,
+	"checked": 0,
+	"rehashed": 0,
+	"rejected": 0,
+	"queued": 0,
+	"running": 0,
+	"last_latency": 0.0,
+	"total_latency": 0.0,
+	"total_wait": 0.0
+}
+metrics_lock = threading.Lock()
+
+def count(key, value=1):
+	with metrics_lock:
+		metrics[key] += value
+
+def pool():
+	global executor
+	with executor_lock:
+		if executor is None:
+			executor = ThreadPoolExecutor(max_workers=worker_count, thread_name_prefix="hashing")
+		return executor
+
+def timed(key, submitted, function, *args):
+	start = time.monotonic()
+	with metrics_lock:
+		metrics["queued"] -= 1
+		metrics["running"] += 1
+		metrics["total_wait"] += start - submitted
+	try:
+		return function(*args)
+	finally:
+		latency = time.monotonic() - start
+		with metrics_lock:
+			metrics["running"] -= 1
+			metrics[key] += 1
+			metrics["last_latency"] = latency
+			metrics["total_latency"] += latency
+
+def run(key, function, *args):
+	if not slots.acquire(blocking=False):
+		count("rejected")
+		return None
+	count("queued")
+	try:
+		future = pool().submit(timed, key, time.monotonic(), function, *args)
+	except RuntimeError:
+		count("queued", -1)
+		slots.release()
+		raise
+	future.add_done_callback(lambda _: slots.release())
+	return future.result()
+
+def hash_password(password):
+	hashed = run("hashed", bcrypt.hashpw, password.encode("utf-8"), bcrypt.gensalt(rounds))
+	return hashed.decode("utf-8") if hashed is not None else None
+
+def check_password(password, hashed):
+	return run("checked", bcrypt.checkpw, password.encode("utf-8"), hashed.encode("utf-8"))
+
+def needs_rehash(hashed):
+	return int(hashed.split("$")[2]) != rounds
+
+def rehash(password):
+	hashed = hash_password(password)
+	if hashed is not None:
+		count("rehashed")
+	return hashed
+
+def hash_metrics():
+	with metrics_lock:
+		data = dict(metrics)
+	operations = data["hashed"] + data["checked"]
+	data["workers"] = worker_count
+	data["queue_size"] = queue_size
+	data["average_latency"] = data["total_latency"] / operations if operations else 0.0
+	data["average_wait"] = data["total_wait"] / operations if operations else 0.0
+	del data["total_latency"], data["total_wait"]
+	return data
@@ -0,0 +1,61 @@
+from apis.validation import entry_fields
+from datetime import date
+import csv, io, itertools, zipfile
+
+batch_size = 5000
+max_errors = 100
+read_errors = (UnicodeDecodeError, csv.Error, zipfile.BadZipFile, KeyError, ValueError, OSError)
+
+def file_kind(filename):
+	return "xlsx" if (filename or "").lower().endswith(".xlsx") else "csv"
+
+def cell_text(value):
+	if value is None:
+		return ""
+	if isinstance(value, date):
+		return value.strftime("%Y-%m-%d")
+	if isinstance(value, float) and value.is_integer():
+		return str(int(value))
+	return str(value)
+
+def csv_rows(data):
+	text = io.TextIOWrapper(data, encoding="utf-8-sig", newline="")
+	try:
+		for values in csv.reader(text):
+			yield values
+	finally:
+		if not data.closed:
+			text.detach()
+
+def xlsx_rows(data):
+	from openpyxl import load_workbook
+	workbook = load_workbook(data, read_only=True, data_only=True)
+	try:
+		for values in workbook.active.iter_rows(values_only=True):
+			yield [cell_text(i) for i in values]
+	finally:
+		workbook.close()
+
+def numbered(rows, header):
+	for number, values in enumerate(rows, 2):
+		if any([i.strip() for i in values]):
+			yield number, dict(zip(header, values))
+
+def read_file(data, kind):
+	data.seek(0)
+	rows = xlsx_rows(data) if kind == "xlsx" else csv_rows(data)
+	header = [i.strip().lower() for i in next(rows, [])]
+	missing = [i for i in entry_fields if i not in header]
+	return missing, numbered(rows, header)
+
+def batches(rows):
+	while True:
+		batch = list(itertools.islice(rows, batch_size))
+		if not batch:
+			return
+		yield [i[0] for i in batch], [i[1] for i in batch]
+
+def row_errors(errors, numbers):
+	for i in errors:
+		i["row"] = numbers[i.pop("index")]
+	return errors
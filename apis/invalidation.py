@@ -0,0 +1,50 @@
+from apis.db import get_db
+import json, threading
+
+handlers = {}
+last_seen = None
+lock = threading.Lock()
+keep = "-1 hour"
+
+def create_invalidations_table(cursor):
+	cursor.execute("""CREATE TABLE IF NOT EXISTS invalidations (
+		id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL UNIQUE,
+		kind TEXT NOT NULL,
+		args TEXT NOT NULL,
+		created DATETIME NOT NULL DEFAULT (datetime('now'))
+	)""")
+
+def subscribe(kind, handler):
+	if handler not in handlers.setdefault(kind, []):
+		handlers[kind].append(handler)
+
+def publish(cursor, kind, *args):
+	cursor.execute("INSERT INTO invalidations (kind, args) VALUES(?, ?)", (kind, json.dumps(args)))
+
+def forget_all():
+	for kind in handlers:
+		for handler in handlers[kind]:
+			handler()
+
+def catch_up():
+	global last_seen
+	db = get_db()
+	latest = db.execute("SELECT MAX(id) FROM invalidations").fetchone()[0] or 0
+	with lock:
+		if last_seen is None or latest == last_seen:
+			last_seen = latest
+			return
+		rows = db.execute("SELECT id, kind, args FROM invalidations WHERE id > ? AND id <= ? ORDER BY id", (last_seen, latest)).fetchall()
+		if latest < last_seen or not rows or rows[0][0] != last_seen + 1:
+			forget_all()
+		else:
+			for _, kind, args in rows:
+				if kind in handlers:
+					for handler in handlers[kind]:
+						handler(*json.loads(args))
+				else:
+					forget_all()
+		last_seen = latest
+
+def prune(cursor):
+	cursor.execute("DELETE FROM invalidations WHERE created <= datetime('now', ?)", (keep,))
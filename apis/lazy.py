@@ -0,0 +1,18 @@
+from importlib import import_module
+import threading
+
+class LazyModule:
+	def __init__(self, name):
+		self.name = name
+		self.module = None
+		self.lock = threading.Lock()
+
+	def __getattr__(self, attr):
+		if self.module is None:
+			with self.lock:
+				if self.module is None:
+					self.module = import_module(self.name)
+		return getattr(self.module, attr)
+
+def lazy(name):
+	return LazyModule(name)
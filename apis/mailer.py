@@ -0,0 +1,100 @@
+from dotenv import load_dotenv
+from flask import current_app
+import os, queue, smtplib, threading, time
+
+load_dotenv()
+
+outbox = queue.Queue(maxsize=int(os.getenv("MAIL_QUEUE_SIZE", 1000)))
+worker_count = int(os.getenv("MAIL_WORKERS", 2))
+retries = 3
+backoff = 1
+idle_timeout = 30
+workers = []
+workers_lock = threading.Lock()
+metrics = {
+	"sent": 0,
+	"failed": 0,
+	"retried": 0,
+	"rejected": 0,
+	"last_latency": 0.0,
+	"total_latency": 0.0
+}
+metrics_lock = threading.Lock()
+
+def count(key, value=1):
+	with metrics_lock:
+		metrics[key] += value
+
+def disconnect(connection):
+	try:
+		connection.host.quit()
+	except Exception:
+		pass
+
+def worker(app, mail):
+	with app.app_context():
+		connection = None
+		while True:
+			try:
+				message, attempts = outbox.get(timeout=idle_timeout)
+			except queue.Empty:
+				if connection is not None:
+					disconnect(connection)
+					connection = None
+				continue
+			start = time.monotonic()
+			try:
+				if connection is None:
+					connection = mail.connect()
+					connection.host = connection.configure_host()
+				connection.send(message)
+				latency = time.monotonic() - start
+				with metrics_lock:
+					metrics["sent"] += 1
+					metrics["last_latency"] = latency
+					metrics["total_latency"] += latency
+			except (smtplib.SMTPException, OSError) as e:
+				print(e)
+				if connection is not None:
+					disconnect(connection)
+					connection = None
+				if attempts < retries:
+					count("retried")
+					time.sleep(backoff * 2**attempts)
+					try:
+						outbox.put_nowait((message, attempts + 1))
+					except queue.Full:
+						count("failed")
+				else:
+					count("failed")
+			finally:
+				outbox.task_done()
+
+def start(mail):
+	with workers_lock:
+		if workers:
+			return
+		app = current_app._get_current_object()
+		for _ in range(worker_count):
+			t = threading.Thread(target=worker, args=(app, mail), daemon=True)
+			t.start()
+			workers.append(t)
+
+def queue_mail(mail, message):
+	if not workers:
+		start(mail)
+	try:
+		outbox.put_nowait((message, 0))
+	except queue.Full:
+		count("rejected")
+		return False
+	return True
+
+def mail_metrics():
+	with metrics_lock:
+		data = dict(metrics)
+	data["queue_depth"] = outbox.qsize()
+	data["workers"] = len(workers)
+	data["average_latency"] = data["total_latency"] / data["sent"] if data["sent"] else 0.0
+	del data["total_latency"]
+	return data
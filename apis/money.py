@@ -0,0 +1,10 @@
+from decimal import Decimal
+
+scale = 100
+
+def to_display(value):
+	if value is None:
+		return 0
+	if value % scale == 0:
+		return value // scale
+	return float(Decimal(value)/scale)
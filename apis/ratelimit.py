@@ -0,0 +1,54 @@
+from collections import OrderedDict
+from dotenv import load_dotenv
+import os, threading, time
+
+load_dotenv()
+
+limits = {
+	"ip": (float(os.getenv("AUTH_IP_PER_MINUTE", 20)) / 60, float(os.getenv("AUTH_IP_BURST", 20))),
+	"account": (float(os.getenv("AUTH_ACCOUNT_PER_MINUTE", 5)) / 60, float(os.getenv("AUTH_ACCOUNT_BURST", 5)))
+}
+buckets = OrderedDict()
+buckets_size = int(os.getenv("RATE_LIMIT_SIZE", 10000))
+lock = threading.Lock()
+metrics = {
+	"allowed": 0,
+	"limited_ip": 0,
+	"limited_account": 0,
+	"evicted": 0
+}
+
+def take(kind, key, now):
+	rate, burst = limits[kind]
+	tokens, updated = buckets.get((kind, key), (burst, now))
+	tokens = min(burst, tokens + (now - updated) * rate)
+	allowed = tokens >= 1
+	buckets[(kind, key)] = (tokens - 1 if allowed else tokens, now)
+	buckets.move_to_end((kind, key))
+	return 0 if allowed else (1 - tokens) / rate
+
+def admit(ip, accounts):
+	now = time.monotonic()
+	with lock:
+		wait = take("ip", ip, now)
+		if wait:
+			metrics["limited_ip"] += 1
+		else:
+			for account in accounts:
+				wait = take("account", account, now)
+				if wait:
+					metrics["limited_account"] += 1
+					break
+			else:
+				metrics["allowed"] += 1
+		while len(buckets) > buckets_size:
+			buckets.popitem(last=False)
+			metrics["evicted"] += 1
+	return wait
+
+def rate_metrics():
+	with lock:
+		data = dict(metrics)
+		data["buckets"] = len(buckets)
+	data["buckets_size"] = buckets_size
+	return data
@@ -0,0 +1,92 @@
+from apis.money import to_display
+from collections import OrderedDict
+import threading
+
+cache = OrderedDict()
+cache_size = 256
+generation = 0
+lock = threading.Lock()
+
+def aggregate(cursor, tables):
+	journal_scope, bs_scope = tables["journal"], tables["bs"]
+	cursor.execute(f"""SELECT totals.account, totals.debit, totals.credit, bs.type, bs.subtype, bs.operation FROM (
+			SELECT account, SUM(debit) AS debit, SUM(credit) AS credit FROM (
+				SELECT ac_debited AS account, amount AS debit, 0 AS credit FROM {journal_scope.table} WHERE {journal_scope.where}
+				UNION ALL SELECT ac_credited, 0, amount FROM {journal_scope.table} WHERE {journal_scope.where}
+			) GROUP BY account
+		) AS totals
+		LEFT JOIN (SELECT * FROM {bs_scope.table} WHERE {bs_scope.where}) AS bs ON bs.account=totals.account
+		ORDER BY totals.account
+	""", journal_scope.params + journal_scope.params + bs_scope.params)
+	return cursor.fetchall()
+
+def trial_balance(rows):
+	accounts = []
+	for account, debit, credit, type, subtype, operation in rows:
+		balance = debit - credit
+		accounts.append({
+			"account": account,
+			"type": type or "nota",
+			"subtype": subtype,
+			"debit": balance if balance > 0 else 0,
+			"credit": -balance if balance < 0 else 0
+		})
+	debit_total = sum([i["debit"] for i in accounts])
+	credit_total = sum([i["credit"] for i in accounts])
+	for i in accounts:
+		i["debit"] = to_display(i["debit"])
+		i["credit"] = to_display(i["credit"])
+	return {
+		"accounts": accounts,
+		"debit_total": to_display(debit_total),
+		"credit_total": to_display(credit_total)
+	}
+
+def profit_and_loss(rows):
+	income, expenses = [], []
+	for account, debit, credit, type, subtype, operation in rows:
+		if type in ("asset", "liability"):
+			continue
+		balance = debit - credit
+		if balance < 0:
+			income.append({"account": account, "amount": -balance})
+		elif balance > 0:
+			expenses.append({"account": account, "amount": balance})
+	income_total = sum([i["amount"] for i in income])
+	expenses_total = sum([i["amount"] for i in expenses])
+	for i in income + expenses:
+		i["amount"] = to_display(i["amount"])
+	return {
+		"income": income,
+		"income_total": to_display(income_total),
+		"expenses": expenses,
+		"expenses_total": to_display(expenses_total),
+		"net_profit": to_display(income_total - expenses_total)
+	}
+
+def report(cursor, tables, key, name):
+	with lock:
+		reports = cache.get(key)
+		if reports is not None:
+			cache.move_to_end(key)
+	if reports is None:
+		with lock:
+			started = generation
+		rows = aggregate(cursor, tables)
+		reports = {
+			"trial_balance": trial_balance(rows),
+			"profit_and_loss": profit_and_loss(rows)
+		}
+		with lock:
+			if started == generation:
+				cache[key] = reports
+				while len(cache) > cache_size:
+					cache.popitem(last=False)
+	return reports[name]
+
+def forget_reports(*prefix):
+	global generation
+	with lock:
+		generation += 1
+		for key in [i for i in cache if i[:len(prefix)] == prefix]:
+			del cache[key]
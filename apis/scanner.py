@@ -0,0 +1,167 @@
+from apis.streaming import copy_stream
+from collections import OrderedDict
+from contextlib import contextmanager
+from dotenv import load_dotenv
+import hashlib, io, os, shutil, socket, struct, threading, time
+
+load_dotenv()
+
+clamd_host = os.getenv("CLAMD_HOST", "127.0.0.1")
+clamd_port = int(os.getenv("CLAMD_PORT", 3310))
+timeout = 30
+health_interval = 10
+chunk_size = 1 << 20
+verdicts = OrderedDict()
+verdicts_size = 1024
+verdict_ttl = 3600
+verdicts_lock = threading.Lock()
+connection = None
+request_id = 0
+last_used = 0.0
+lock = threading.Lock()
+
+def local_socket():
+	if os.getenv("CLAMD_SOCKET"):
+		return os.getenv("CLAMD_SOCKET")
+	for path in ["/etc/clamav/clamd.conf", "/etc/clamd.conf"]:
+		if not os.path.isfile(path):
+			continue
+		with open(path) as f:
+			for line in f:
+				words = line.split()
+				if len(words) > 1 and words[0] == "LocalSocket":
+					return words[1]
+	return None
+
+def connect():
+	global connection, request_id
+	path = local_socket()
+	try:
+		if not path:
+			raise OSError("No clamd unix socket configured")
+		connection = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		connection.settimeout(timeout)
+		connection.connect(path)
+	except OSError:
+		connection = socket.create_connection((clamd_host, clamd_port), timeout)
+	connection.sendall(b"zIDSESSION\0")
+	request_id = 0
+
+def disconnect():
+	global connection
+	if connection is None:
+		return
+	try:
+		connection.sendall(b"zEND\0")
+		connection.close()
+	except OSError:
+		pass
+	connection = None
+
+def send(command):
+	global request_id
+	request_id += 1
+	connection.sendall(command)
+
+def reply():
+	data = b""
+	while not data.endswith(b"\0"):
+		chunk = connection.recv(4096)
+		if not chunk:
+			raise ConnectionError("ClamAV daemon closed the connection")
+		data += chunk
+	number, _, text = data[:-1].decode("utf-8", "replace").partition(": ")
+	if number != str(request_id):
+		raise ConnectionError(f"Unexpected ClamAV reply {data!r}")
+	return text
+
+def ready():
+	if connection is not None and time.monotonic() - last_used < health_interval:
+		return
+	for _ in range(2):
+		try:
+			if connection is None:
+				connect()
+			send(b"zPING\0")
+			if reply() == "PONG":
+				return
+		except OSError:
+			pass
+		disconnect()
+	raise ConnectionError("ClamAV daemon unresponsive")
+
+class HashStream(io.RawIOBase):
+	def __init__(self):
+		self.hash = hashlib.sha256()
+
+	def writable(self):
+		return True
+
+	def write(self, data):
+		self.hash.update(data)
+		return len(data)
+
+class ScanStream(io.RawIOBase):
+	def __init__(self):
+		self.virus = None
+
+	def writable(self):
+		return True
+
+	def write(self, data):
+		connection.sendall(struct.pack("!L", len(data)))
+		connection.sendall(data)
+		return len(data)
+
+	def finish(self):
+		connection.sendall(struct.pack("!L", 0))
+		text = reply()
+		if text.endswith(" FOUND"):
+			self.virus = text[len("stream: "):-len(" FOUND")]
+		elif text != "stream: OK":
+			raise ConnectionError(f"ClamAV scan failed: {text}")
+
+@contextmanager
+def scanning():
+	global last_used
+	with lock:
+		ready()
+		stream = ScanStream()
+		try:
+			send(b"zINSTREAM\0")
+			yield stream
+			stream.finish()
+		except BaseException:
+			disconnect()
+			raise
+		finally:
+			last_used = time.monotonic()
+
+def cached_verdict(digest):
+	with verdicts_lock:
+		verdict = verdicts.get(digest)
+		if verdict is None or time.monotonic() - verdict[0] > verdict_ttl:
+			return False, None
+		verdicts.move_to_end(digest)
+		return True, verdict[1]
+
+def remember(digest, virus):
+	with verdicts_lock:
+		verdicts[digest] = (time.monotonic(), virus)
+		verdicts.move_to_end(digest)
+		while len(verdicts) > verdicts_size:
+			verdicts.popitem(last=False)
+
+def virus_scan(source, target):
+	digest = HashStream()
+	copy_stream(source, target, digest, chunk_size=chunk_size)
+	digest = digest.hash.hexdigest()
+	found, virus = cached_verdict(digest)
+	if found:
+		return virus
+	target.flush()
+	target.seek(0)
+	with scanning() as scan:
+		shutil.copyfileobj(target, scan, chunk_size)
+	remember(digest, scan.virus)
+	return scan.virus
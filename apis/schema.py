@@ -0,0 +1,312 @@
+from apis.invalidation import create_invalidations_table, publish
+from apis.money import scale
+from collections import namedtuple
+from datetime import datetime
+from dotenv import load_dotenv
+import os
+
+load_dotenv()
+
+TABLES = 0
+MIGRATING = 1
+SINGLE = 2
+
+Scope = namedtuple("Scope", ["table", "where", "params", "columns", "values"])
+
+def layout(cursor, user_id=None):
+	cursor.execute("PRAGMA user_version")
+	version = cursor.fetchone()[0]
+	if version != MIGRATING:
+		return version
+	cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (f"fys_{user_id}",))
+	return TABLES if cursor.fetchone() else SINGLE
+
+def scopes(cursor, user_id, fy_id=None):
+	return layout_scopes(layout(cursor, user_id), user_id, fy_id)
+
+def layout_scopes(version, user_id, fy_id=None):
+	if version == SINGLE:
+		tables = {"fys": Scope("fys", "user_id=?", (user_id,), "user_id, ", "?, ")}
+		for name in ["journal", "bs", "balances", "periods"]:
+			tables[name] = Scope(name, "user_id=? AND fy_id=?", (user_id, fy_id), "user_id, fy_id, ", "?, ?, ")
+		return tables
+	tables = {"fys": Scope(f"fys_{user_id}", "1", (), "", "")}
+	for name in ["journal", "bs", "balances", "periods"]:
+		tables[name] = Scope(f"{name}_{user_id}_{fy_id}", "1", (), "", "")
+	return tables
+
+def create_journal_table(cursor, table, single=False):
+	scope = "user_id INTEGER NOT NULL,\n\t\tfy_id INTEGER NOT NULL,\n\t\t" if single else ""
+	cursor.execute(f"""CREATE TABLE IF NOT EXISTS {table} (
+		id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL UNIQUE,
+		{scope}date TEXT NOT NULL,
+		ac_debited TEXT NOT NULL,
+		ac_credited TEXT NOT NULL,
+		amount INTEGER NOT NULL,
+		description TEXT NOT NULL
+	)""")
+
+def create_single_tables(cursor):
+	cursor.execute("""CREATE TABLE IF NOT EXISTS fys (
+		id INTEGER PRIMARY KEY UNIQUE NOT NULL,
+		user_id INTEGER NOT NULL,
+		name TEXT NOT NULL,
+		status TEXT NOT NULL DEFAULT "open"
+	)""")
+	cursor.execute("CREATE INDEX IF NOT EXISTS fys_user ON fys (user_id, name)")
+	create_journal_table(cursor, "journal", True)
+	cursor.execute("CREATE INDEX IF NOT EXISTS journal_debited ON journal (user_id, fy_id, ac_debited, date, id, ac_credited, amount)")
+	cursor.execute("CREATE INDEX IF NOT EXISTS journal_credited ON journal (user_id, fy_id, ac_credited, date, id, ac_debited, amount)")
+	cursor.execute("CREATE INDEX IF NOT EXISTS journal_date ON journal (user_id, fy_id, date)")
+	cursor.execute("""CREATE TABLE IF NOT EXISTS bs (
+		id INTEGER PRIMARY KEY UNIQUE NOT NULL,
+		user_id INTEGER NOT NULL,
+		fy_id INTEGER NOT NULL,
+		account TEXT NOT NULL,
+		type TEXT NOT NULL,
+		subtype TEXT NOT NULL,
+		operation TEXT NOT NULL
+	)""")
+	cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS bs_account ON bs (user_id, fy_id, account)")
+	cursor.execute("""CREATE TABLE IF NOT EXISTS balances (
+		id INTEGER PRIMARY KEY UNIQUE NOT NULL,
+		user_id INTEGER NOT NULL,
+		fy_id INTEGER NOT NULL,
+		account TEXT NOT NULL,
+		debit INTEGER NOT NULL DEFAULT 0,
+		credit INTEGER NOT NULL DEFAULT 0,
+		entries INTEGER NOT NULL DEFAULT 0
+	)""")
+	cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS balances_account ON balances (user_id, fy_id, account)")
+	cursor.execute("""CREATE TABLE IF NOT EXISTS periods (
+		id INTEGER PRIMARY KEY UNIQUE NOT NULL,
+		user_id INTEGER NOT NULL,
+		fy_id INTEGER NOT NULL,
+		period TEXT NOT NULL,
+		account TEXT NOT NULL,
+		debit INTEGER NOT NULL DEFAULT 0,
+		credit INTEGER NOT NULL DEFAULT 0,
+		entries INTEGER NOT NULL DEFAULT 0
+	)""")
+	cursor.execute("CREATE UNIQUE INDEX IF NOT EXISTS periods_account ON periods (user_id, fy_id, period, account)")
+
+def create_user_tables(cursor, user_id):
+	if layout(cursor, user_id) == SINGLE:
+		return
+	cursor.execute(f"""CREATE TABLE IF NOT EXISTS fys_{user_id} (
+		id INTEGER PRIMARY KEY UNIQUE NOT NULL,
+		name TEXT NOT NULL,
+		status TEXT NOT NULL DEFAULT "open"
+	)""")
+
+def create_fy_tables(cursor, user_id, fy_id):
+	if layout(cursor, user_id) == SINGLE:
+		return
+	create_journal_table(cursor, f"journal_{user_id}_{fy_id}")
+	cursor.execute(f"""CREATE TABLE IF NOT EXISTS bs_{user_id}_{fy_id} (
+		id INTEGER PRIMARY KEY UNIQUE NOT NULL,
+		account TEXT NOT NULL,
+		type TEXT NOT NULL,
+		subtype TEXT NOT NULL,
+		operation TEXT NOT NULL
+	)""")
+	create_indexes(cursor, user_id, fy_id)
+	create_balances(cursor, user_id, fy_id)
+
+def create_indexes(cursor, user_id, fy_id):
+	cursor.execute(f"CREATE INDEX IF NOT EXISTS journal_{user_id}_{fy_id}_debited ON journal_{user_id}_{fy_id} (ac_debited, date, id, ac_credited, amount)")
+	cursor.execute(f"CREATE INDEX IF NOT EXISTS journal_{user_id}_{fy_id}_credited ON journal_{user_id}_{fy_id} (ac_credited, date, id, ac_debited, amount)")
+	cursor.execute(f"CREATE INDEX IF NOT EXISTS journal_{user_id}_{fy_id}_date ON journal_{user_id}_{fy_id} (date)")
+	cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND name=?", (f"bs_{user_id}_{fy_id}_account",))
+	if not cursor.fetchone():
+		cursor.execute(f"DELETE FROM bs_{user_id}_{fy_id} WHERE id NOT IN (SELECT MAX(id) FROM bs_{user_id}_{fy_id} GROUP BY account)")
+		cursor.execute(f"CREATE UNIQUE INDEX bs_{user_id}_{fy_id}_account ON bs_{user_id}_{fy_id} (account)")
+
+def create_balances(cursor, user_id, fy_id):
+	cursor.execute(f"""CREATE TABLE IF NOT EXISTS balances_{user_id}_{fy_id} (
+		id INTEGER PRIMARY KEY UNIQUE NOT NULL,
+		account TEXT NOT NULL UNIQUE,
+		debit INTEGER NOT NULL DEFAULT 0,
+		credit INTEGER NOT NULL DEFAULT 0,
+		entries INTEGER NOT NULL DEFAULT 0
+	)""")
+	cursor.execute(f"""CREATE TABLE IF NOT EXISTS periods_{user_id}_{fy_id} (
+		id INTEGER PRIMARY KEY UNIQUE NOT NULL,
+		period TEXT NOT NULL,
+		account TEXT NOT NULL,
+		debit INTEGER NOT NULL DEFAULT 0,
+		credit INTEGER NOT NULL DEFAULT 0,
+		entries INTEGER NOT NULL DEFAULT 0,
+		UNIQUE (period, account)
+	)""")
+
+def rebuild_balances(cursor, tables):
+	journal, balances, periods = tables["journal"], tables["balances"], tables["periods"]
+	cursor.execute(f"DELETE FROM {balances.table} WHERE {balances.where}", balances.params)
+	cursor.execute(f"""INSERT INTO {balances.table} ({balances.columns}account, debit, credit, entries)
+		SELECT {balances.values}account, SUM(debit), SUM(credit), COUNT(*) FROM (
+			SELECT ac_debited AS account, amount AS debit, 0 AS credit FROM {journal.table} WHERE {journal.where}
+			UNION ALL SELECT ac_credited, 0, amount FROM {journal.table} WHERE {journal.where}
+		) GROUP BY account
+	""", balances.params + journal.params + journal.params)
+	cursor.execute(f"DELETE FROM {periods.table} WHERE {periods.where}", periods.params)
+	cursor.execute(f"""INSERT INTO {periods.table} ({periods.columns}period, account, debit, credit, entries)
+		SELECT {periods.values}period, account, SUM(debit), SUM(credit), COUNT(*) FROM (
+			SELECT substr(date, 1, 7) AS period, ac_debited AS account, amount AS debit, 0 AS credit FROM {journal.table} WHERE {journal.where}
+			UNION ALL SELECT substr(date, 1, 7), ac_credited, 0, amount FROM {journal.table} WHERE {journal.where}
+		) GROUP BY period, account
+	""", periods.params + journal.params + journal.params)
+
+def drop_fy(cursor, user_id, fy_id):
+	if layout(cursor, user_id) == SINGLE:
+		for name in ["journal", "bs", "balances", "periods"]:
+			cursor.execute(f"DELETE FROM {name} WHERE user_id=? AND fy_id=?", (user_id, fy_id))
+		return
+	for name in ["journal", "bs", "balances", "periods"]:
+		cursor.execute(f"""DROP TABLE IF EXISTS "{name}_{user_id}_{fy_id}" """)
+
+def drop_user(cursor, user_id):
+	if layout(cursor, user_id) == SINGLE:
+		for name in ["fys", "journal", "bs", "balances", "periods"]:
+			cursor.execute(f"DELETE FROM {name} WHERE user_id=?", (user_id,))
+		return
+	cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (f"fys_{user_id}",))
+	if not cursor.fetchone():
+		return
+	cursor.execute(f"SELECT id FROM fys_{user_id}")
+	for (fy_id,) in cursor.fetchall():
+		drop_fy(cursor, user_id, fy_id)
+	cursor.execute(f"""DROP TABLE IF EXISTS "fys_{user_id}" """)
+
+def journal_tables(cursor):
+	cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'journal\\_%' ESCAPE '\\'")
+	return [i[0].split("_")[1:] for i in cursor.fetchall()]
+
+def all_fys(cursor):
+	fys = journal_tables(cursor)
+	cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='fys'")
+	if cursor.fetchone():
+		cursor.execute("SELECT user_id, id FROM fys")
+		fys += [list(i) for i in cursor.fetchall()]
+	return fys
+
+def migrate(db):
+	cursor = db.cursor()
+	create_single_tables(cursor)
+	create_invalidations_table(cursor)
+	cursor.execute(f"PRAGMA user_version={MIGRATING}")
+	db.commit()
+	cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'fys\\_%' ESCAPE '\\'")
+	users = sorted([int(i[0].split("_")[1]) for i in cursor.fetchall()])
+	for user_id in users:
+		cursor.execute("BEGIN IMMEDIATE")
+		cursor.execute(f"SELECT id, name, status FROM fys_{user_id} ORDER BY id")
+		for old_id, name, status in cursor.fetchall():
+			cursor.execute("SELECT id FROM fys WHERE id=?", (old_id,))
+			if cursor.fetchone():
+				cursor.execute("INSERT INTO fys (user_id, name, status) VALUES(?, ?, ?)", (user_id, name, status))
+			else:
+				cursor.execute("INSERT INTO fys (id, user_id, name, status) VALUES(?, ?, ?, ?)", (old_id, user_id, name, status))
+			fy_id = cursor.lastrowid
+			cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (f"journal_{user_id}_{old_id}",))
+			if cursor.fetchone():
+				cursor.execute(f"SELECT id FROM journal_{user_id}_{old_id} WHERE id IN (SELECT id FROM journal) LIMIT 1")
+				ids = "" if cursor.fetchone() else "id, "
+				cursor.execute(f"""INSERT INTO journal ({ids}user_id, fy_id, date, ac_debited, ac_credited, amount, description)
+					SELECT {ids}?, ?, date, ac_debited, ac_credited, amount, description FROM journal_{user_id}_{old_id} ORDER BY id
+				""", (user_id, fy_id))
+			cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (f"bs_{user_id}_{old_id}",))
+			if cursor.fetchone():
+				cursor.execute(f"""INSERT OR REPLACE INTO bs (user_id, fy_id, account, type, subtype, operation)
+					SELECT ?, ?, account, type, subtype, operation FROM bs_{user_id}_{old_id} ORDER BY id
+				""", (user_id, fy_id))
+			rebuild_balances(cursor, layout_scopes(SINGLE, user_id, fy_id))
+			drop_fy(cursor, user_id, old_id)
+		cursor.execute(f"DROP TABLE fys_{user_id}")
+		publish(cursor, "reset")
+		db.commit()
+	cursor.execute(f"PRAGMA user_version={SINGLE}")
+	db.commit()
+	return len(users)
+
+def migrate_amounts(cursor):
+	cursor.execute("CREATE TABLE IF NOT EXISTS settings (name TEXT PRIMARY KEY NOT NULL, value TEXT NOT NULL)")
+	cursor.execute("SELECT value FROM settings WHERE name='amounts'")
+	if cursor.fetchone():
+		return
+	for user_id, fy_id in all_fys(cursor):
+		tables = scopes(cursor, user_id, fy_id)
+		journal = tables["journal"]
+		cursor.execute(f"UPDATE {journal.table} SET amount=CAST(ROUND(amount*{scale}) AS INTEGER) WHERE {journal.where}", journal.params)
+		cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (tables["periods"].table,))
+		if cursor.fetchone():
+			rebuild_balances(cursor, tables)
+	cursor.execute("INSERT INTO settings (name, value) VALUES('amounts', 'minor')")
+
+def padded_date(date):
+	try:
+		date = datetime.strptime(date.strip(), "%Y-%m-%d")
+	except ValueError:
+		return None
+	return f"{date.year:04d}-{date.month:02d}-{date.day:02d}"
+
+def migrate_dates(cursor):
+	cursor.execute("SELECT value FROM settings WHERE name='dates'")
+	if cursor.fetchone():
+		return
+	for user_id, fy_id in all_fys(cursor):
+		tables = scopes(cursor, user_id, fy_id)
+		journal = tables["journal"]
+		cursor.execute(f"SELECT id, date FROM {journal.table} WHERE {journal.where} AND date NOT GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]'", journal.params)
+		dates = [(padded_date(date), id) for id, date in cursor.fetchall()]
+		dates = [i for i in dates if i[0]]
+		if not dates:
+			continue
+		cursor.executemany(f"UPDATE {journal.table} SET date=? WHERE {journal.where} AND id=?", [(date,) + journal.params + (id,) for date, id in dates])
+		cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name=?", (tables["periods"].table,))
+		if cursor.fetchone():
+			rebuild_balances(cursor, tables)
+	cursor.execute("INSERT INTO settings (name, value) VALUES('dates', 'padded')")
+
+def migrate_journal_ids(cursor):
+	cursor.execute("SELECT value FROM settings WHERE name='journal_ids'")
+	if cursor.fetchone():
+		return
+	cursor.execute("SELECT name, sql FROM sqlite_master WHERE type='table' AND (name='journal' OR name LIKE 'journal\\_%' ESCAPE '\\')")
+	for table, sql in cursor.fetchall():
+		if "AUTOINCREMENT" in sql:
+			continue
+		create_journal_table(cursor, f"new_{table}", table == "journal")
+		cursor.execute(f"INSERT INTO new_{table} SELECT * FROM {table}")
+		cursor.execute(f"DROP TABLE {table}")
+		cursor.execute(f"ALTER TABLE new_{table} RENAME TO {table}")
+		if table == "journal":
+			create_single_tables(cursor)
+		else:
+			create_indexes(cursor, *table.split("_")[1:])
+	cursor.execute("INSERT INTO settings (name, value) VALUES('journal_ids', 'autoincrement')")
+
+def setup(cursor):
+	cursor.execute("PRAGMA user_version")
+	version = cursor.fetchone()[0]
+	if version == TABLES and os.getenv("SCHEMA_LAYOUT") == "single":
+		cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name LIKE 'fys\\_%' ESCAPE '\\'")
+		if not cursor.fetchone():
+			version = SINGLE
+			cursor.execute(f"PRAGMA user_version={SINGLE}")
+	if version != TABLES:
+		cursor.execute("SELECT name FROM sqlite_master WHERE type='table' AND name='periods'")
+		periods = cursor.fetchone()
+		create_single_tables(cursor)
+		if not periods:
+			cursor.execute("""INSERT INTO periods (user_id, fy_id, period, account, debit, credit, entries)
+				SELECT user_id, fy_id, period, account, SUM(debit), SUM(credit), COUNT(*) FROM (
+					SELECT user_id, fy_id, substr(date, 1, 7) AS period, ac_debited AS account, amount AS debit, 0 AS credit FROM journal
+					UNION ALL SELECT user_id, fy_id, substr(date, 1, 7), ac_credited, 0, amount FROM journal
+				) GROUP BY user_id, fy_id, period, account
+			""")
+	for user_id, fy_id in journal_tables(cursor):
+		create_indexes(cursor, user_id, fy_id)
+	migrate_amounts(cursor)
+	migrate_dates(cursor)
+	migrate_journal_ids(cursor)
@@ -0,0 +1,159 @@
+from apis.lazy import lazy
+from collections import Counter, OrderedDict
+from importlib.util import find_spec
+import math, os, re, threading
+
+np = lazy("numpy")
+sparse = lazy("scipy.sparse")
+vectorized = find_spec("numpy") is not None and find_spec("scipy") is not None
+white_spaces = re.compile(r"\s\s+")
+budget = int(os.getenv("SEARCH_INDEX_BUDGET", 64*1024*1024))
+indexes = OrderedDict()
+lock = threading.Lock()
+
+def analyzer(text, min_n=2, max_n=4):
+	grams = []
+	for word in white_spaces.sub(" ", text.lower()).split():
+		word = f" {word} "
+		for n in range(min_n, max_n + 1):
+			grams.extend([word[i:i + n] for i in range(max(len(word) - n + 1, 1))])
+			if len(word) <= n:
+				break
+	return grams
+
+def new_index():
+	return {
+		"vocabulary": {},
+		"grams": [],
+		"df": [],
+		"free": [],
+		"docs": {},
+		"names": None,
+		"matrix": None,
+		"idf": None,
+		"size": 0,
+		"stale": True
+	}
+
+def add_doc(index, name):
+	doc = {}
+	for gram, count in Counter(analyzer(name)).items():
+		col = index["vocabulary"].get(gram)
+		if col is None:
+			if index["free"]:
+				col = index["free"].pop()
+				index["grams"][col] = gram
+			else:
+				col = len(index["df"])
+				index["grams"].append(gram)
+				index["df"].append(0)
+			index["vocabulary"][gram] = col
+			index["size"] += 80
+		index["df"][col] += 1
+		doc[col] = count
+	index["docs"][name] = doc
+	index["size"] += 80*len(doc)
+
+def remove_doc(index, name):
+	doc = index["docs"].pop(name)
+	for col in doc:
+		index["df"][col] -= 1
+		if not index["df"][col]:
+			del index["vocabulary"][index["grams"][col]]
+			index["grams"][col] = None
+			index["free"].append(col)
+			index["size"] -= 80
+	index["size"] -= 80*len(doc)
+
+def build_matrix(index):
+	names = list(index["docs"].keys())
+	index["idf"] = [math.log((1+len(names))/(1+i)) + 1 for i in index["df"]]
+	index["names"] = names
+	if not vectorized:
+		index["matrix"] = []
+		for name in names:
+			doc = {col: count*index["idf"][col] for col, count in index["docs"][name].items()}
+			norm = math.sqrt(sum([i*i for i in doc.values()])) or 1
+			index["matrix"].append({col: value/norm for col, value in doc.items()})
+		return
+	cols, data, indptr = [], [], [0]
+	for name in names:
+		doc = index["docs"][name]
+		cols.extend(doc.keys())
+		data.extend(doc.values())
+		indptr.append(len(cols))
+	cols = np.array(cols, dtype=np.int64)
+	indptr = np.array(indptr, dtype=np.int64)
+	values = np.array(data, dtype=np.float64)*np.array(index["idf"], dtype=np.float64)[cols]
+	rows = np.repeat(np.arange(len(names)), np.diff(indptr))
+	norms = np.sqrt(np.bincount(rows, weights=values**2, minlength=len(names)))
+	values /= np.where(norms > 0, norms, 1)[rows]
+	index["matrix"] = sparse.csr_matrix((values, cols, indptr), shape=(len(names), len(index["df"])))
+
+def sync(key, rows, field):
+	index = indexes.get(key)
+	if index is None:
+		index = new_index()
+		indexes[key] = index
+	indexes.move_to_end(key)
+	if index["stale"]:
+		names = set([row[field].lower() for row in rows])
+		removed = [i for i in index["docs"] if i not in names]
+		added = [i for i in names if i not in index["docs"]]
+		for name in removed:
+			remove_doc(index, name)
+		for name in added:
+			add_doc(index, name)
+		if removed or added or index["matrix"] is None:
+			build_matrix(index)
+		index["stale"] = False
+	total = sum([i["size"] for i in indexes.values()])
+	while total > budget and len(indexes) > 1:
+		_, oldest = indexes.popitem(last=False)
+		total -= oldest["size"]
+	return index
+
+def scores(index, query):
+	query = [(index["vocabulary"][gram], count) for gram, count in Counter(analyzer(query)).items() if gram in index["vocabulary"]]
+	query = [(col, count) for col, count in query if index["df"][col] > 0]
+	if not query or not index["names"]:
+		return {}
+	weights = {col: count*index["idf"][col] for col, count in query}
+	norm = math.sqrt(sum([i*i for i in weights.values()]))
+	if not vectorized:
+		return {name: sum([doc.get(col, 0)*weight for col, weight in weights.items()])/norm for name, doc in zip(index["names"], index["matrix"])}
+	vec = np.zeros(len(index["df"]))
+	for col, weight in weights.items():
+		vec[col] = weight/norm
+	sim = index["matrix"] @ vec
+	return dict(zip(index["names"], sim.tolist()))
+
+def search(key, rows, field, query, threshold=0.3):
+	query = query.strip().lower()
+	with lock:
+		index = sync(key, rows, field)
+		sim = scores(index, query)
+	rows = [(sim.get(row[field].lower(), 0), row) for row in rows]
+	rows = [i for i in rows if i[0] >= threshold]
+	rows.sort(key=lambda i: -i[0])
+	return [i[1] for i in rows]
+
+def stale(*prefix):
+	with lock:
+		for key, index in indexes.items():
+			if key[:len(prefix)] == prefix:
+				index["stale"] = True
+
+def forget_ledgers(*key):
+	stale("ledger", *key)
+
+def forget_fys(*key):
+	stale("fys", *key)
+
+def forget_users(*key):
+	stale("users", *key)
+
+def evict(*prefix):
+	with lock:
+		for key in [i for i in indexes if i[:len(prefix)] == prefix]:
+			del indexes[key]
@@ -0,0 +1,59 @@
+from werkzeug.serving import make_server
+import os, signal, threading, time
+
+drain_timeout = 30
+
+def run_worker(server):
+	stop = lambda signum, frame: threading.Thread(target=server.shutdown).start()
+	signal.signal(signal.SIGTERM, stop)
+	signal.signal(signal.SIGINT, stop)
+	try:
+		server.serve_forever()
+	finally:
+		server.server_close()
+
+def spawn(server, workers):
+	pid = os.fork()
+	if pid == 0:
+		code = 0
+		try:
+			run_worker(server)
+		except BaseException as e:
+			print(e)
+			code = 1
+		finally:
+			os._exit(code)
+	workers.add(pid)
+
+def reap(workers, block=False):
+	while workers:
+		pid, _ = os.waitpid(-1, 0 if block else os.WNOHANG)
+		if not pid:
+			return
+		workers.discard(pid)
+
+def serve(app, host, port, count):
+	server = make_server(host, port, app, threaded=True)
+	server.daemon_threads = False
+	stopping = []
+	signal.signal(signal.SIGTERM, lambda signum, frame: stopping.append(signum))
+	signal.signal(signal.SIGINT, lambda signum, frame: stopping.append(signum))
+	workers = set()
+	print(f" * Serving on http://{host}:{server.port} with {count} workers")
+	try:
+		while not stopping:
+			reap(workers)
+			while len(workers) < count and not stopping:
+				spawn(server, workers)
+			time.sleep(1)
+	finally:
+		for pid in workers:
+			os.kill(pid, signal.SIGTERM)
+		deadline = time.monotonic() + drain_timeout
+		while workers and time.monotonic() < deadline:
+			reap(workers)
+			time.sleep(0.1)
+		for pid in workers:
+			os.kill(pid, signal.SIGKILL)
+		reap(workers, True)
+		server.server_close()
@@ -0,0 +1,67 @@
+import csv, io, json, zipfile, zlib
+
+class ChunkStream(io.RawIOBase):
+	def __init__(self):
+		self.chunks = []
+
+	def writable(self):
+		return True
+
+	def write(self, data):
+		self.chunks.append(bytes(data))
+		return len(data)
+
+	def drain(self):
+		data = b"".join(self.chunks)
+		self.chunks = []
+		return data
+
+def csv_bytes(rows):
+	text = io.StringIO()
+	csv.writer(text, lineterminator="\r\n").writerows(rows)
+	return text.getvalue().encode("utf-8")
+
+def zip_stream(files):
+	stream = ChunkStream()
+	with zipfile.ZipFile(stream, "w", zipfile.ZIP_DEFLATED) as archive:
+		for name, data in files:
+			with archive.open(name, "w") as f:
+				f.write(data)
+			chunk = stream.drain()
+			if chunk:
+				yield chunk
+	yield stream.drain()
+
+def gzip_stream(f, chunk_size=1 << 20):
+	deflate = zlib.compressobj(6, zlib.DEFLATED, 31)
+	while True:
+		chunk = f.read(chunk_size)
+		if not chunk:
+			break
+		data = deflate.compress(chunk)
+		if data:
+			yield data
+	yield deflate.flush()
+
+def gzip_lines(lines):
+	deflate = zlib.compressobj(6, zlib.DEFLATED, 31)
+	for line in lines:
+		data = deflate.compress((json.dumps(line, separators=(",", ":")) + "\n").encode("utf-8"))
+		if data:
+			yield data
+	yield deflate.flush()
+
+def copy_stream(source, *targets, chunk_size=1 << 20):
+	chunk = source.read(chunk_size)
+	inflate = zlib.decompressobj(47) if chunk[:2] == b"\x1f\x8b" else None
+	while chunk:
+		data = chunk
+		chunk = b""
+		if inflate is not None:
+			data = inflate.decompress(data, chunk_size)
+			chunk = inflate.unconsumed_tail
+		if data:
+			for target in targets:
+				target.write(data)
+		if not chunk:
+			chunk = source.read(chunk_size)
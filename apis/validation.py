@@ -0,0 +1,119 @@
+from apis.lazy import lazy
+from apis.money import scale
+
+np = lazy("numpy")
+
+entry_fields = ["date", "ac_debited", "ac_credited", "amount", "description"]
+
+def column(entries, field):
+	values = [i.get(field) if isinstance(i, dict) else None for i in entries]
+	present = np.array([i is not None for i in values], dtype=bool)
+	strings = np.array(["" if i is None else str(i) for i in values], dtype=str)
+	return present, np.char.strip(strings)
+
+def pad_dates(dates):
+	year = np.char.partition(dates, "-")
+	rest = np.char.partition(year[:, 2], "-")
+	month, day = rest[:, 0], rest[:, 2]
+	short = (np.char.str_len(year[:, 0]) == 4) & (year[:, 1] == "-") & (rest[:, 1] == "-")
+	short &= (np.char.str_len(month) >= 1) & (np.char.str_len(month) <= 2) & (np.char.str_len(day) >= 1) & (np.char.str_len(day) <= 2)
+	padded = np.char.add(np.char.add(np.char.add(year[:, 0], "-"), np.char.zfill(month, 2)), np.char.add("-", np.char.zfill(day, 2)))
+	return np.where(short, padded, dates)
+
+def parse_dates(dates):
+	valid = np.char.str_len(dates) == 10
+	chars = np.full((len(dates), 10), "0", dtype="U1")
+	chars[valid] = dates[valid].astype("U10").view("U1").reshape(-1, 10)
+	valid &= (chars[:, 4] == "-") & (chars[:, 7] == "-")
+	digits = chars[:, [0, 1, 2, 3, 5, 6, 8, 9]]
+	valid &= ((digits >= "0") & (digits <= "9")).all(axis=1)
+	digits = np.where(valid[:, None], digits.view(np.uint32).astype(np.int64) - 48, 0)
+	year = digits[:, 0]*1000 + digits[:, 1]*100 + digits[:, 2]*10 + digits[:, 3]
+	month = digits[:, 4]*10 + digits[:, 5]
+	day = digits[:, 6]*10 + digits[:, 7]
+	valid &= (year >= 1) & (month >= 1) & (month <= 12)
+	months = np.where(valid, (year - 1970)*12 + month - 1, 0).astype("datetime64[M]")
+	days = ((months + 1).astype("datetime64[D]") - months.astype("datetime64[D]")).astype(np.int64)
+	return valid & (day >= 1) & (day <= days)
+
+def parse_integers(strings, digits=15):
+	valid = (np.char.str_len(strings) > 0) & (np.char.str_len(strings) <= digits) & (np.char.str_len(np.char.strip(strings, "0123456789")) == 0)
+	values = np.zeros(len(strings), dtype=np.int64)
+	values[valid] = strings[valid].astype(np.int64)
+	return valid, values
+
+def parse_amounts(amounts):
+	amounts = np.char.lstrip(amounts, "+")
+	parts = np.char.partition(amounts, ".")
+	whole, fraction = parts[:, 0], np.char.rstrip(parts[:, 2], "0")
+	places = len(str(scale)) - 1
+	valid = (np.char.str_len(fraction) <= places) & (np.char.str_len(amounts) > np.char.str_len(parts[:, 1]))
+	whole_valid, whole = parse_integers(np.where(np.char.str_len(whole) > 0, whole, "0"))
+	fraction_valid, fraction = parse_integers(np.char.ljust(np.where(valid, fraction, ""), places, "0"))
+	valid &= whole_valid & fraction_valid
+	values = np.where(valid, whole*scale + fraction, 0)
+	return valid & (values > 0), values
+
+def list_error(list_name):
+	entry_error = {
+		"error": "invalid list",
+		"field": None
+	}
+	if list_name:
+		entry_error["list"] = list_name
+	return entry_error
+
+def errors_at(errors, mask, field, error, list_name):
+	for i in np.flatnonzero(mask).tolist():
+		entry_error = {
+			"error": error,
+			"field": field,
+			"index": i
+		}
+		if list_name:
+			entry_error["list"] = list_name
+		errors.append(entry_error)
+
+def check_entries(entries, list_name=None, ids=False):
+	fields = (["id"] if ids else []) + entry_fields
+	if not entries:
+		return [], {field: [] for field in fields}
+	if not isinstance(entries, list):
+		return [list_error(list_name)], None
+	errors = []
+	entry = np.array([isinstance(i, dict) for i in entries], dtype=bool)
+	errors_at(errors, ~entry, None, "invalid entry", list_name)
+	columns = {}
+	for field in fields:
+		present, values = column(entries, field)
+		missing = entry & ~present
+		empty = entry & present & (np.char.str_len(values) == 0)
+		if field == "id":
+			parsed, values = parse_integers(values)
+			errors_at(errors, entry & ~parsed, None, "Invalid id", list_name)
+		else:
+			errors_at(errors, missing, field, "Not submitted", list_name)
+			errors_at(errors, empty, field, "empty", list_name)
+			checked = entry & present & ~empty
+			if field == "amount":
+				parsed, values = parse_amounts(values)
+				errors_at(errors, checked & ~parsed, field, "invalid amount", list_name)
+			elif field == "date":
+				values = pad_dates(values)
+				errors_at(errors, checked & ~parse_dates(values), field, "invalid date", list_name)
+		columns[field] = values.tolist()
+	errors.sort(key=lambda i: i["index"])
+	if errors:
+		return errors, None
+	return [], columns
+
+def check_ids(ids, list_name=None):
+	if not ids:
+		return [], []
+	if not isinstance(ids, list):
+		return [list_error(list_name)], None
+	errors = []
+	values = np.array([str(i).strip() for i in ids], dtype=str)
+	parsed, values = parse_integers(values)
+	errors_at(errors, ~parsed, None, "Invalid id", list_name)
+	return errors, values.tolist()
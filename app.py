@@ -1,13 +1,62 @@
-from flask import Blueprint, current_app, Flask
+from apis.accounting_api import accounting
+from apis.admin_api import admin, seed_admin
+from apis.authentication_api import authentication, create_auth_tables, forget_session, mail, mail_config
+from apis.db import database, get_db, release_db, reset_pool
+from apis.invalidation import catch_up, create_invalidations_table, subscribe
+from apis.reports import forget_reports
+from apis.search_index import forget_fys, forget_ledgers, forget_users
+from apis.schema import setup
+from apis.serving import serve
+from flask import current_app, Flask
+import click, os
 
-app = Flask(__name__)
-with app.app_context():
-	from apis.authentication_api import authentication
+def bootstrap(app):
+	with app.app_context():
+		db = get_db()
+		cursor = db.cursor()
+		cursor.execute("BEGIN IMMEDIATE")
+		create_auth_tables(cursor)
+		create_invalidations_table(cursor)
+		setup(cursor)
+		seed_admin(cursor)
+		db.commit()
+		db.close()
+	reset_pool()
+
+@click.command("bootstrap")
+def bootstrap_command():
+	bootstrap(current_app._get_current_object())
+	print("Database ready")
+
+@click.command("serve")
+@click.option("--host", default="127.0.0.1")
+@click.option("--port", default=5000)
+@click.option("--workers", default=os.cpu_count() or 1)
+def serve_command(host, port, workers):
+	app = current_app._get_current_object()
+	bootstrap(app)
+	serve(app, host, port, workers)
+
+def create_app(config=None):
+	app = Flask(__name__)
+	app.config.from_mapping(DATABASE=database, **mail_config())
+	app.config.from_mapping(config or {})
+	app.teardown_appcontext(release_db)
+	app.before_request(catch_up)
+	mail.init_app(app)
+	subscribe("reports", forget_reports)
+	subscribe("reports", forget_ledgers)
+	subscribe("fys", forget_fys)
+	subscribe("users", forget_users)
+	subscribe("sessions", forget_session)
 	app.register_blueprint(authentication)
-	from apis.accounting_api import accounting
 	app.register_blueprint(accounting)
-	from apis.admin_api import admin
 	app.register_blueprint(admin)
+	app.cli.add_command(bootstrap_command)
+	app.cli.add_command(serve_command)
+	return app
 
 if __name__ == "__main__":
+	app = create_app()
+	bootstrap(app)
 	app.run()
\ No newline at end of file
@@ -0,0 +1,51 @@
+import os, random, sqlite3, sys, tempfile, time
+
+ACCOUNTS = [f"Account {i}" for i in range(200)]
+LOOKUPS = 50
+
+def build(cursor, rows):
+	cursor.execute("""CREATE TABLE journal_1_1 (
+		id INTEGER PRIMARY KEY UNIQUE NOT NULL,
+		date TEXT NOT NULL,
+		ac_debited TEXT NOT NULL,
+		ac_credited TEXT NOT NULL,
+		amount INTEGER NOT NULL,
+		description TEXT NOT NULL
+	)""")
+	random.seed(rows)
+	cursor.executemany("INSERT INTO journal_1_1 (date, ac_debited, ac_credited, amount, description) VALUES(?, ?, ?, ?, ?)", (
+		(f"2024-{random.randint(1, 12):02d}-{random.randint(1, 28):02d}", random.choice(ACCOUNTS), random.choice(ACCOUNTS), random.randint(1, 100000), "entry")
+		for _ in range(rows)
+	))
+
+def index(cursor):
+	cursor.execute("CREATE INDEX journal_1_1_debited ON journal_1_1 (ac_debited, date, id, ac_credited, amount)")
+	cursor.execute("CREATE INDEX journal_1_1_credited ON journal_1_1 (ac_credited, date, id, ac_debited, amount)")
+	cursor.execute("CREATE INDEX journal_1_1_date ON journal_1_1 (date)")
+
+def ledger(cursor):
+	random.seed(0)
+	start = time.perf_counter()
+	for _ in range(LOOKUPS):
+		account = random.choice(ACCOUNTS)
+		cursor.execute("SELECT id,date,ac_credited AS account,amount FROM journal_1_1 WHERE ac_debited=? ORDER BY date, id", (account,))
+		cursor.fetchall()
+		cursor.execute("SELECT id,date,ac_debited AS account,amount FROM journal_1_1 WHERE ac_credited=? ORDER BY date, id", (account,))
+		cursor.fetchall()
+	return (time.perf_counter() - start) / LOOKUPS * 1000
+
+if __name__ == "__main__":
+	sizes = [int(i) for i in sys.argv[1:]] or [10000, 100000, 1000000]
+	print(f"{'rows':>10} {'no index (ms)':>15} {'indexed (ms)':>15}")
+	for rows in sizes:
+		with tempfile.TemporaryDirectory() as directory:
+			db = sqlite3.connect(os.path.join(directory, "bench.db"))
+			cursor = db.cursor()
+			build(cursor, rows)
+			db.commit()
+			before = ledger(cursor)
+			index(cursor)
+			db.commit()
+			after = ledger(cursor)
+			db.close()
+		print(f"{rows:>10} {before:>15.2f} {after:>15.2f}")
@@ -0,0 +1,41 @@
+import json, os, statistics, subprocess, sys, tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY = ["numpy", "scipy", "sklearn", "openpyxl"]
+PROBE = """
+import json, resource, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter() - start
+heavy = [i for i in %r if i in sys.modules]
+rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / (1 << 20 if sys.platform == "darwin" else 1 << 10)
+from apis.search_index import search
+rows = [{"name": f"Account {i}"} for i in range(200)]
+start = time.perf_counter()
+search(("bench",), rows, "name", "account 1")
+searched = time.perf_counter() - start
+print(json.dumps({"import": imported, "rss": rss, "search": searched, "heavy": heavy}))
+""" % HEAVY
+
+def probe(directory):
+	env = dict(os.environ, DATABASE=os.path.join(directory, "data.db"), ADMIN_PASSWORD="Bench@1234")
+	output = subprocess.run([sys.executable, "-c", PROBE], cwd=ROOT, env=env, capture_output=True, text=True, check=True).stdout
+	return json.loads(output.strip().splitlines()[-1])
+
+def report(name, results):
+	imported = statistics.median([i["import"] for i in results]) * 1000
+	rss = statistics.median([i["rss"] for i in results])
+	searched = statistics.median([i["search"] for i in results]) * 1000
+	heavy = ",".join(results[-1]["heavy"]) or "-"
+	print(f"{name:>10} {imported:>12.1f} {rss:>10.1f} {searched:>18.1f} {heavy:>20}")
+
+if __name__ == "__main__":
+	runs = int(sys.argv[1]) if sys.argv[1:] else 5
+	print(f"{'start':>10} {'import (ms)':>12} {'rss (MB)':>10} {'first search (ms)':>18} {'heavy at import':>20}")
+	first, restarts = [], []
+	for _ in range(runs):
+		with tempfile.TemporaryDirectory() as directory:
+			first.append(probe(directory))
+			restarts.append(probe(directory))
+	report("first", first)
+	report("restart", restarts)
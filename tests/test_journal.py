@@ -0,0 +1,69 @@
+from app import bootstrap, create_app
+import hashlib, json, pytest, sqlite3
+
+TOKEN = "test-session-token"
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+	monkeypatch.setenv("ADMIN_PASSWORD", "Test@1234")
+	monkeypatch.delenv("SCHEMA_LAYOUT", raising=False)
+	database = str(tmp_path / "data.db")
+	app = create_app({"DATABASE": database})
+	bootstrap(app)
+	db = sqlite3.connect(database)
+	db.execute("INSERT INTO users (username, email, password, ip) VALUES('tester', 'tester@example.com', 'x', '127.0.0.1')")
+	db.execute("INSERT INTO sessions (token_hash, user_id, expires) SELECT ?, id, datetime('now', '+1 day') FROM users WHERE username='tester'",
+		(hashlib.sha256(TOKEN.encode("utf-8")).digest(),))
+	db.commit()
+	db.close()
+	client = app.test_client()
+	client.set_cookie("user_token", TOKEN)
+	return client
+
+@pytest.fixture
+def fy_id(client):
+	return client.post("/fy", data={"fy_name": "2024"}).json["row"]["id"]
+
+def entry(amount, description):
+	return {"date": "2024-01-01", "ac_debited": "Cash", "ac_credited": "Sales", "amount": str(amount), "description": description}
+
+@pytest.mark.parametrize("body", ["5", '"journal"', "null"])
+def test_rejects_non_object_body(client, fy_id, body):
+	response = client.post(f"/journal/{fy_id}", data=body, content_type="application/json")
+	assert response.status_code == 400
+	assert response.json == {"error": "Invalid journal"}
+
+@pytest.mark.parametrize("name, value", [("inserted", {"date": "2024-01-01"}), ("updated", "1"), ("deleted", 5), ("deleted", {"1": 1})])
+def test_rejects_non_list_changes(client, fy_id, name, value):
+	response = client.post(f"/journal/{fy_id}", json={name: value})
+	assert response.status_code == 400
+	assert response.json == [{"error": "invalid list", "field": None, "list": name}]
+
+def test_does_not_reuse_ids(client, fy_id):
+	response = client.post(f"/journal/{fy_id}", json={"inserted": [entry(1, "a"), entry(2, "b"), entry(3, "c")]})
+	assert response.json["inserted"] == [1, 2, 3]
+	response = client.post(f"/journal/{fy_id}", json={"deleted": [3], "inserted": [entry(4, "d")]})
+	assert response.json["inserted"] == [4]
+	response = client.post(f"/journal/{fy_id}", json={"deleted": [4]})
+	response = client.post(f"/journal/{fy_id}", json={"inserted": [entry(5, "e")]})
+	assert response.json["inserted"] == [5]
+	rows = client.get(f"/journal/{fy_id}").json["rows"]
+	assert [(i["id"], i["description"]) for i in rows] == [(1, "a"), (2, "b"), (5, "e")]
+
+@pytest.mark.parametrize("changes", [{"deleted": [1, 99]}, {"updated": [dict(entry(7, "x"), id=99)]}, {"deleted": [2], "updated": [dict(entry(7, "x"), id=2)]}])
+def test_rejects_missing_ids(client, fy_id, changes):
+	client.post(f"/journal/{fy_id}", json={"inserted": [entry(1, "a")]})
+	response = client.post(f"/journal/{fy_id}", json=dict(changes, inserted=[entry(9, "z")]))
+	assert response.status_code == 409
+	rows = client.get(f"/journal/{fy_id}").json["rows"]
+	assert [(i["id"], i["description"]) for i in rows] == [(1, "a")]
+	assert client.get(f"/reports/{fy_id}/trial_balance").json["debit_total"] == 1
+
+def test_page_total(client, fy_id):
+	client.post(f"/journal/{fy_id}", json={"inserted": [entry(1, "a"), entry(2, "b"), entry(3.5, "c")]})
+	data = client.get(f"/journal/{fy_id}?limit=2").json
+	assert (data["total"], data["page_total"], data["next"]) == (6.5, 3, 2)
+	data = client.get(f"/journal/{fy_id}?after=2").json
+	assert (data["total"], data["page_total"]) == (6.5, 3.5)
+	lines = [json.loads(i) for i in client.get(f"/journal/{fy_id}?format=ndjson&limit=1").data.decode("utf-8").splitlines()]
+	assert (lines[-1]["total"], lines[-1]["page_total"], lines[-1]["count"]) == (6.5, 1, 1)
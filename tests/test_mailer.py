@@ -0,0 +1,101 @@
+from apis import mailer
+from flask import Flask
+from flask_mail import Mail, Message
+import pytest, socketserver, threading, time, types
+
+class SMTPHandler(socketserver.StreamRequestHandler):
+	def handle(self):
+		server = self.server
+		with server.lock:
+			server.connections += 1
+		self.wfile.write(b"220 localhost ESMTP\r\n")
+		for line in self.rfile:
+			command = line[:4].upper()
+			if command == b"DATA":
+				self.wfile.write(b"354 End data with <CR><LF>.<CR><LF>\r\n")
+				data = b"".join(iter(self.rfile.readline, b".\r\n"))
+				with server.lock:
+					server.messages.append(data)
+				self.wfile.write(b"250 OK\r\n")
+			elif command == b"MAIL" and server.failures:
+				with server.lock:
+					server.failures -= 1
+				self.wfile.write(b"451 Try again later\r\n")
+			elif command == b"QUIT":
+				with server.lock:
+					server.quits += 1
+				self.wfile.write(b"221 Bye\r\n")
+				return
+			else:
+				self.wfile.write(b"250 OK\r\n")
+
+@pytest.fixture(scope="module")
+def smtp():
+	server = socketserver.ThreadingTCPServer(("127.0.0.1", 0), SMTPHandler)
+	server.daemon_threads = True
+	server.lock = threading.Lock()
+	server.connections = 0
+	server.quits = 0
+	server.failures = 0
+	server.messages = []
+	threading.Thread(target=server.serve_forever, daemon=True).start()
+	yield server
+	server.shutdown()
+	server.server_close()
+
+@pytest.fixture(scope="module")
+def app(smtp):
+	app = Flask(__name__)
+	app.config.update(MAIL_SERVER="127.0.0.1", MAIL_PORT=smtp.server_address[1], MAIL_USE_TLS=False, MAIL_USE_SSL=False, MAIL_DEFAULT_SENDER="books@example.com")
+	app.extensions["test_mail"] = Mail(app)
+	return app
+
+@pytest.fixture
+def sleeps(monkeypatch):
+	sleeps = []
+	monkeypatch.setattr(mailer, "time", types.SimpleNamespace(monotonic=time.monotonic, sleep=sleeps.append))
+	return sleeps
+
+def send(app, count):
+	with app.app_context():
+		for i in range(count):
+			assert mailer.queue_mail(app.extensions["test_mail"], Message(f"Message {i}", recipients=["user@example.com"], body="Hello"))
+	mailer.outbox.join()
+
+def changes(before):
+	after = mailer.mail_metrics()
+	return {key: after[key] - before[key] for key in ["sent", "failed", "retried", "rejected"]}
+
+def test_reuses_connections(app, smtp, sleeps):
+	before = mailer.mail_metrics()
+	send(app, 20)
+	assert changes(before) == {"sent": 20, "failed": 0, "retried": 0, "rejected": 0}
+	assert len(smtp.messages) == 20
+	send(app, 5)
+	assert len(smtp.messages) == 25
+	assert 1 <= smtp.connections <= mailer.worker_count
+	assert smtp.quits == 0
+	metrics = mailer.mail_metrics()
+	assert metrics["workers"] == mailer.worker_count
+	assert metrics["queue_depth"] == 0
+	assert metrics["average_latency"] > 0
+	assert sleeps == []
+
+def test_retries_with_backoff(app, smtp, sleeps):
+	before = mailer.mail_metrics()
+	quits = smtp.quits
+	smtp.failures = 1
+	send(app, 1)
+	assert changes(before) == {"sent": 1, "failed": 0, "retried": 1, "rejected": 0}
+	assert sleeps == [mailer.backoff]
+	assert smtp.quits == quits + 1
+
+def test_gives_up_after_retries(app, smtp, sleeps):
+	before = mailer.mail_metrics()
+	messages = len(smtp.messages)
+	smtp.failures = mailer.retries + 1
+	send(app, 1)
+	assert changes(before) == {"sent": 0, "failed": 1, "retried": mailer.retries, "rejected": 0}
+	assert sleeps == [mailer.backoff * 2**i for i in range(mailer.retries)]
+	assert len(smtp.messages) == messages
+	assert smtp.failures == 0
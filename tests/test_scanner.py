@@ -0,0 +1,162 @@
+from apis import scanner
+import io, os, pytest, socket, struct, tempfile, threading, time
+
+EICAR = b"X5O!P%@AP[4\\PZX54(P^)7CC)7}$EICAR-STANDARD-ANTIVIRUS-TEST-FILE!$H+H*"
+
+class FakeClamd:
+	def __init__(self, path):
+		self.path = path
+		self.sessions = []
+		self.streams = []
+		self.clients = []
+		self.server = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+		self.server.bind(path)
+		self.server.listen(8)
+		threading.Thread(target=self.accept, daemon=True).start()
+
+	def accept(self):
+		while True:
+			try:
+				client, _ = self.server.accept()
+			except OSError:
+				return
+			self.clients.append(client)
+			commands = []
+			self.sessions.append(commands)
+			threading.Thread(target=self.handle, args=(client, commands), daemon=True).start()
+
+	def read(self, client, size):
+		data = b""
+		while len(data) < size:
+			chunk = client.recv(size - len(data))
+			if not chunk:
+				raise EOFError
+			data += chunk
+		return data
+
+	def command(self, client):
+		data = b""
+		while not data.endswith(b"\0"):
+			data += self.read(client, 1)
+		return data[:-1]
+
+	def handle(self, client, commands):
+		try:
+			commands.append(self.command(client))
+			number = 0
+			while True:
+				command = self.command(client)
+				commands.append(command)
+				number += 1
+				if command == b"zPING":
+					client.sendall(b"%d: PONG\0" % number)
+				elif command == b"zINSTREAM":
+					frames = []
+					while True:
+						size = struct.unpack("!L", self.read(client, 4))[0]
+						if not size:
+							break
+						frames.append(self.read(client, size))
+					self.streams.append(frames)
+					verdict = b"Eicar-Test-Signature FOUND" if EICAR in b"".join(frames) else b"OK"
+					client.sendall(b"%d: stream: %s\0" % (number, verdict))
+				elif command == b"zEND":
+					break
+		except (EOFError, OSError):
+			pass
+		client.close()
+
+	def drop(self):
+		for client in self.clients:
+			try:
+				client.shutdown(socket.SHUT_RDWR)
+			except OSError:
+				pass
+
+	def stop(self):
+		self.drop()
+		self.server.close()
+
+@pytest.fixture
+def clamd(monkeypatch):
+	directory = tempfile.mkdtemp()
+	path = os.path.join(directory, "clamd.sock")
+	monkeypatch.setenv("CLAMD_SOCKET", path)
+	scanner.disconnect()
+	scanner.verdicts.clear()
+	scanner.last_used = 0.0
+	server = FakeClamd(path)
+	yield server
+	scanner.disconnect()
+	server.stop()
+	os.remove(path)
+	os.rmdir(directory)
+
+class CountingStream(io.BytesIO):
+	def __init__(self, data):
+		super().__init__(data)
+		self.read_bytes = 0
+
+	def read(self, size=-1):
+		data = super().read(size)
+		self.read_bytes += len(data)
+		return data
+
+def scan(data):
+	source = CountingStream(data)
+	target = io.BytesIO()
+	virus = scanner.virus_scan(source, target)
+	assert target.getvalue() == data
+	assert source.read_bytes == len(data)
+	return virus
+
+def test_instream_framing(clamd):
+	data = os.urandom((5 << 20) // 2)
+	assert scan(data) is None
+	assert clamd.sessions == [[b"zIDSESSION", b"zPING", b"zINSTREAM"]]
+	assert [len(frame) for frame in clamd.streams[0]] == [1 << 20, 1 << 20, 1 << 19]
+	assert b"".join(clamd.streams[0]) == data
+	assert scan(b"second file") is None
+	assert clamd.sessions == [[b"zIDSESSION", b"zPING", b"zINSTREAM", b"zINSTREAM"]]
+
+def test_found(clamd):
+	assert scan(b"attachment " + EICAR) == "Eicar-Test-Signature"
+	assert scan(b"clean") is None
+
+def test_reconnects_after_drop(clamd):
+	assert scan(b"first") is None
+	clamd.drop()
+	with pytest.raises(OSError):
+		scan(b"second")
+	assert scanner.connection is None
+	assert scan(b"third") is None
+	assert len(clamd.sessions) == 2
+	assert clamd.sessions[1] == [b"zIDSESSION", b"zPING", b"zINSTREAM"]
+
+def test_health_check_reconnects(clamd):
+	assert scan(b"first") is None
+	clamd.drop()
+	scanner.last_used = time.monotonic() - scanner.health_interval
+	assert scan(b"second") is None
+	assert len(clamd.sessions) == 2
+	assert clamd.sessions[1] == [b"zIDSESSION", b"zPING", b"zINSTREAM"]
+
+def test_cached_verdict(clamd):
+	infected = b"attachment " + EICAR
+	assert scan(infected) == "Eicar-Test-Signature"
+	assert scan(b"clean") is None
+	assert scan(infected) == "Eicar-Test-Signature"
+	assert scan(b"clean") is None
+	assert len(clamd.streams) == 2
+	assert clamd.sessions[0].count(b"zINSTREAM") == 2
+
+def test_cached_verdict_skips_session_lock(clamd):
+	infected = b"attachment " + EICAR
+	assert scan(infected) == "Eicar-Test-Signature"
+	results = []
+	with scanner.lock:
+		thread = threading.Thread(target=lambda: results.append(scan(infected)))
+		thread.start()
+		thread.join(5)
+		assert results == ["Eicar-Test-Signature"]
+	assert len(clamd.streams) == 1
@@ -0,0 +1,111 @@
+from apis.schema import create_fy_tables, create_user_tables, migrate, scopes, setup, SINGLE
+import pytest, sqlite3
+
+@pytest.fixture
+def cursor(monkeypatch):
+	monkeypatch.delenv("SCHEMA_LAYOUT", raising=False)
+	db = sqlite3.connect(":memory:")
+	yield db.cursor()
+	db.close()
+
+def legacy_journal(cursor):
+	cursor.execute("""CREATE TABLE fys_1 (
+		id INTEGER PRIMARY KEY UNIQUE NOT NULL,
+		name TEXT NOT NULL,
+		status TEXT NOT NULL DEFAULT "open"
+	)""")
+	cursor.execute("INSERT INTO fys_1 (name) VALUES('2024')")
+	cursor.execute("""CREATE TABLE journal_1_1 (
+		id INTEGER PRIMARY KEY UNIQUE NOT NULL,
+		date TEXT NOT NULL,
+		ac_debited TEXT NOT NULL,
+		ac_credited TEXT NOT NULL,
+		amount INTEGER NOT NULL,
+		description TEXT NOT NULL
+	)""")
+	cursor.executemany("INSERT INTO journal_1_1 (date, ac_debited, ac_credited, amount, description) VALUES(?, ?, ?, ?, ?)", [
+		("2024-02-01", "Cash", "Sales", "100", "February"),
+		("2024-1-5", "Cash", "Sales", "12.5", "January"),
+		("2024-12-3", "Rent", "Cash", "40", "December")
+	])
+	cursor.execute("""CREATE TABLE bs_1_1 (
+		id INTEGER PRIMARY KEY UNIQUE NOT NULL,
+		account TEXT NOT NULL,
+		type TEXT NOT NULL,
+		subtype TEXT NOT NULL,
+		operation TEXT NOT NULL
+	)""")
+
+def test_pads_legacy_dates(cursor):
+	legacy_journal(cursor)
+	setup(cursor)
+	cursor.execute("SELECT date, amount FROM journal_1_1 ORDER BY date")
+	assert cursor.fetchall() == [("2024-01-05", 1250), ("2024-02-01", 10000), ("2024-12-03", 4000)]
+	cursor.execute("SELECT description FROM journal_1_1 WHERE date>=? AND date<=?", ("2024-01-01", "2024-01-31"))
+	assert cursor.fetchall() == [("January",)]
+
+def test_stops_reusing_journal_ids(cursor):
+	legacy_journal(cursor)
+	setup(cursor)
+	cursor.execute("SELECT sql FROM sqlite_master WHERE name='journal_1_1'")
+	assert "AUTOINCREMENT" in cursor.fetchone()[0]
+	cursor.execute("SELECT name FROM sqlite_master WHERE type='index' AND tbl_name='journal_1_1' AND name LIKE 'journal%'")
+	assert len(cursor.fetchall()) == 3
+	cursor.execute("DELETE FROM journal_1_1 WHERE id=3")
+	cursor.execute("INSERT INTO journal_1_1 (date, ac_debited, ac_credited, amount, description) VALUES('2024-01-01', 'Cash', 'Sales', 1, 'new')")
+	cursor.execute("SELECT id, description FROM journal_1_1 ORDER BY id")
+	assert cursor.fetchall() == [(1, "February"), (2, "January"), (4, "new")]
+
+def test_rebuilds_periods(cursor):
+	setup(cursor)
+	create_user_tables(cursor, 1)
+	cursor.execute("INSERT INTO fys_1 (name) VALUES('2024')")
+	create_fy_tables(cursor, 1, 1)
+	cursor.execute("INSERT INTO journal_1_1 (date, ac_debited, ac_credited, amount, description) VALUES('2024-1-5', 'Cash', 'Sales', 1250, 'January')")
+	cursor.execute("INSERT INTO periods_1_1 (period, account, debit, credit, entries) VALUES('2024-1-', 'Cash', 1250, 0, 1)")
+	cursor.execute("DELETE FROM settings WHERE name='dates'")
+	setup(cursor)
+	cursor.execute("SELECT date FROM journal_1_1")
+	assert cursor.fetchall() == [("2024-01-05",)]
+	cursor.execute("SELECT period, account, debit, credit FROM periods_1_1 ORDER BY account")
+	assert cursor.fetchall() == [("2024-01", "Cash", 1250, 0), ("2024-01", "Sales", 0, 1250)]
+	cursor.execute("UPDATE journal_1_1 SET date='2024-1-6'")
+	setup(cursor)
+	cursor.execute("SELECT date FROM journal_1_1")
+	assert cursor.fetchall() == [("2024-1-6",)]
+
+def test_pads_single_layout(cursor, monkeypatch):
+	monkeypatch.setenv("SCHEMA_LAYOUT", "single")
+	setup(cursor)
+	cursor.execute("INSERT INTO fys (user_id, name) VALUES(1, '2024')")
+	cursor.execute("INSERT INTO journal (user_id, fy_id, date, ac_debited, ac_credited, amount, description) VALUES(1, 1, '2024-3-9', 'Cash', 'Sales', 500, 'March')")
+	cursor.execute("DELETE FROM settings WHERE name='dates'")
+	setup(cursor)
+	cursor.execute("SELECT date FROM journal")
+	assert cursor.fetchall() == [("2024-03-09",)]
+	tables = scopes(cursor, 1, 1)
+	cursor.execute(f"SELECT period, account FROM {tables['periods'].table} ORDER BY account")
+	assert cursor.fetchall() == [("2024-03", "Cash"), ("2024-03", "Sales")]
+
+def test_migrate_keeps_ids(cursor):
+	setup(cursor)
+	for user_id in [1, 2]:
+		create_user_tables(cursor, user_id)
+		cursor.execute(f"INSERT INTO fys_{user_id} (name) VALUES('2024')")
+		create_fy_tables(cursor, user_id, 1)
+		cursor.executemany(f"INSERT INTO journal_{user_id}_1 (date, ac_debited, ac_credited, amount, description) VALUES('2024-01-01', 'Cash', 'Sales', ?, ?)",
+			[(100*user_id + i, f"user {user_id} entry {i}") for i in range(3)])
+	cursor.execute("DELETE FROM journal_1_1 WHERE id=2")
+	cursor.connection.commit()
+	assert migrate(cursor.connection) == 2
+	cursor.execute("PRAGMA user_version")
+	assert cursor.fetchone()[0] == SINGLE
+	cursor.execute("SELECT user_id, id FROM fys ORDER BY user_id")
+	fys = dict(cursor.fetchall())
+	cursor.execute("SELECT id, description FROM journal WHERE user_id=1 ORDER BY id")
+	assert cursor.fetchall() == [(1, "user 1 entry 0"), (3, "user 1 entry 2")]
+	cursor.execute("SELECT description FROM journal WHERE user_id=2 ORDER BY id")
+	assert cursor.fetchall() == [("user 2 entry 0",), ("user 2 entry 1",), ("user 2 entry 2",)]
+	assert fys == {1: 1, 2: 2}
+	cursor.execute("SELECT kind FROM invalidations")
+	assert cursor.fetchall() == [("reset",), ("reset",)]
@@ -0,0 +1,45 @@
+from apis import search_index
+import pytest
+
+@pytest.fixture(autouse=True)
+def indexes():
+	search_index.evict()
+	yield
+	search_index.evict()
+
+def rows(*names):
+	return [{"name": i} for i in names]
+
+def test_renames_shrink_vocabulary():
+	search_index.search(("fys", 1), rows("alpha", "beta"), "name", "alpha")
+	index = search_index.indexes[("fys", 1)]
+	size = index["size"]
+	search_index.forget_fys(1)
+	search_index.search(("fys", 1), rows("alpha", "gamma"), "name", "alpha")
+	search_index.forget_fys(1)
+	search_index.search(("fys", 1), rows("alpha"), "name", "alpha")
+	assert not [i for i in index["vocabulary"] if "gam" in i or "bet" in i]
+	assert len(index["vocabulary"]) == len(set(search_index.analyzer("alpha")))
+	assert index["size"] < size
+
+def test_reuses_freed_columns():
+	search_index.search(("fys", 1), rows("alpha", "beta"), "name", "alpha")
+	index = search_index.indexes[("fys", 1)]
+	width = len(index["df"])
+	for name in ["gamma", "delta", "kappa"]:
+		search_index.forget_fys(1)
+		search_index.search(("fys", 1), rows("alpha", name), "name", name)
+	assert len(index["df"]) <= width + len(set(search_index.analyzer("kappa")))
+
+def test_skips_sync_until_invalidated():
+	search_index.search(("fys", 1), rows("alpha"), "name", "alpha")
+	index = search_index.indexes[("fys", 1)]
+	search_index.search(("fys", 1), rows("alpha", "alphas"), "name", "alphas")
+	assert "alphas" not in index["docs"]
+	search_index.forget_fys(2)
+	search_index.search(("fys", 1), rows("alpha", "alphas"), "name", "alphas")
+	assert "alphas" not in index["docs"]
+	search_index.forget_fys(1)
+	found = search_index.search(("fys", 1), rows("alpha", "alphas"), "name", "alphas")
+	assert "alphas" in index["docs"]
+	assert found[0] == {"name": "alphas"}
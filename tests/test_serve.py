@@ -0,0 +1,124 @@
+import hashlib, http.client, json, os, pytest, signal, socket, sqlite3, subprocess, sys, time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+TOKEN = "test-session-token"
+
+def free_port():
+	with socket.socket() as s:
+		s.bind(("127.0.0.1", 0))
+		return s.getsockname()[1]
+
+def request(port, method, path, body=None, token=TOKEN):
+	headers = {"Cookie": f"user_token={token}"}
+	if isinstance(body, dict):
+		body = "&".join(f"{key}={value}" for key, value in body.items())
+		headers["Content-Type"] = "application/x-www-form-urlencoded"
+	elif body is not None:
+		body = json.dumps(body)
+		headers["Content-Type"] = "application/json"
+	connection = http.client.HTTPConnection("127.0.0.1", port, timeout=30)
+	try:
+		connection.request(method, path, body, headers)
+		response = connection.getresponse()
+		data = response.read()
+		return response.status, json.loads(data) if response.getheader("Content-Type", "").startswith("application/json") else data
+	finally:
+		connection.close()
+
+def children(pid):
+	found = []
+	for name in os.listdir("/proc"):
+		if not name.isdigit():
+			continue
+		try:
+			with open(f"/proc/{name}/stat") as f:
+				state, ppid = f.read().rsplit(")", 1)[1].split()[:2]
+		except OSError:
+			continue
+		if int(ppid) == pid and state != "Z":
+			found.append(int(name))
+	return sorted(found)
+
+def wait_for(check, timeout=30):
+	deadline = time.monotonic() + timeout
+	while time.monotonic() < deadline:
+		try:
+			if check():
+				return
+		except OSError:
+			pass
+		time.sleep(0.2)
+	raise TimeoutError
+
+@pytest.fixture
+def database(tmp_path):
+	return str(tmp_path / "data.db")
+
+@pytest.fixture
+def serve(database):
+	masters = []
+	def start(workers):
+		port = free_port()
+		env = dict(os.environ, DATABASE=database, ADMIN_PASSWORD="Test@1234")
+		master = subprocess.Popen([sys.executable, "-m", "flask", "--app", "app", "serve", "--port", str(port), "--workers", str(workers)],
+			cwd=ROOT, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+		masters.append(master)
+		wait_for(lambda: len(children(master.pid)) == workers and request(port, "GET", "/auth")[0] == 200)
+		return master, port
+	yield start
+	for master in masters:
+		if master.poll() is None:
+			master.send_signal(signal.SIGTERM)
+			try:
+				master.wait(timeout=40)
+			except subprocess.TimeoutExpired:
+				master.kill()
+				master.wait()
+
+def sign_in(database):
+	db = sqlite3.connect(database)
+	db.execute("INSERT INTO users (username, email, password, ip) VALUES('tester', 'tester@example.com', 'x', '127.0.0.1')")
+	db.execute("INSERT INTO sessions (token_hash, user_id, expires) SELECT ?, id, datetime('now', '+1 day') FROM users WHERE username='tester'",
+		(hashlib.sha256(TOKEN.encode("utf-8")).digest(),))
+	db.commit()
+	db.close()
+
+def entry(amount, description):
+	return {"date": "2024-01-01", "ac_debited": "Cash", "ac_credited": "Sales", "amount": str(amount), "description": description}
+
+def test_respawns_and_stops_workers(serve, database):
+	master, port = serve(3)
+	sign_in(database)
+	assert request(port, "POST", "/fy", {"fy_name": "2024"})[0] == 200
+	workers = children(master.pid)
+	os.kill(workers[0], signal.SIGKILL)
+	for _ in range(10):
+		assert request(port, "GET", "/fy")[0] == 200
+	wait_for(lambda: len(children(master.pid)) == 3 and workers[0] not in children(master.pid))
+	workers = children(master.pid)
+	for _ in range(10):
+		assert request(port, "GET", "/fy")[0] == 200
+	master.send_signal(signal.SIGTERM)
+	assert master.wait(timeout=40) == 0
+	assert not [pid for pid in workers if os.path.exists(f"/proc/{pid}")]
+	with pytest.raises(OSError):
+		request(port, "GET", "/auth")
+
+def test_invalidates_across_workers(serve, database):
+	_, first = serve(1)
+	_, second = serve(1)
+	sign_in(database)
+	status, fy = request(first, "POST", "/fy", {"fy_name": "2024"})
+	assert status == 200
+	fid = fy["row"]["id"]
+	rows = [entry(100, "first")]
+	assert request(first, "POST", f"/journal/{fid}", rows)[1].get("success")
+	for port in [first, second]:
+		assert request(port, "GET", f"/reports/{fid}/trial_balance")[1]["debit_total"] == 100
+	rows.append(entry(50, "second"))
+	assert request(first, "POST", f"/journal/{fid}", rows)[1].get("success")
+	assert request(second, "GET", f"/reports/{fid}/trial_balance")[1]["debit_total"] == 150
+	assert request(second, "GET", "/fy")[0] == 200
+	assert request(first, "POST", "/signout")[0] == 200
+	status, _ = request(second, "GET", "/fy")
+	assert status == 302